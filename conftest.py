@@ -0,0 +1,18 @@
+import shutil
+import tempfile
+
+import pytest
+
+from core.runner import temp_cache_settings
+
+
+@pytest.fixture(scope='session', autouse=True)
+def temp_cache():
+    """Кэш во временном каталоге, как у manage.py test, см. core/runner.py.
+
+    Иначе cache.clear() в тестах стирал бы кэш yatube/cache.sqlite3.
+    """
+    directory = tempfile.mkdtemp(prefix='yatube-cache-')
+    with temp_cache_settings(directory):
+        yield
+    shutil.rmtree(directory, ignore_errors=True)
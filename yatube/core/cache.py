@@ -0,0 +1,334 @@
+"""Двухуровневый кэш: LRU в памяти процесса перед общим SQLite-хранилищем.
+
+Все процессы на машине читают и пишут один файл SQLite. Каждая запись
+попадает ещё и в журнал инвалидаций, по которому остальные процессы
+выбрасывают свои копии ключа из памяти. PRAGMA data_version дёшево
+сообщает, писал ли кто-нибудь в файл с прошлой проверки, поэтому
+горячие ключи читаются из памяти без запроса к SQLite.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache_entry ('
+    ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_entry_expires ON cache_entry (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_bus ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' key TEXT NOT NULL, origin TEXT NOT NULL)',
+)
+# Запись шины, после которой процессы очищают память целиком. Ключи
+# кэша строит make_key, они всегда содержат двоеточие.
+CLEAR_ALL = '*'
+
+# Живые экземпляры бэкенда. caches в Django свой у каждого потока, так
+# что экземпляров столько же, сколько потоков; слабые ссылки не держат
+# экземпляры завершившихся потоков вместе с их LRU.
+_instances = weakref.WeakSet()
+
+
+def _after_fork():
+    for instance in list(_instances):
+        instance._forked()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class TwoTierCache(BaseCache):
+    """Бэкенд кэша Django с локальным LRU и общей шиной инвалидаций.
+
+    OPTIONS: LOCAL_MAX_ENTRIES — размер LRU процесса, BUS_KEEP — сколько
+    последних инвалидаций хранить. Процесс, отставший от журнала больше
+    чем на BUS_KEEP записей, очищает свой LRU целиком.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.location = location
+        self.local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self.bus_keep = int(options.get('BUS_KEEP', 10000))
+        self.origin = f'{os.getpid()}:{id(self)}'
+        self._local = OrderedDict()
+        self._lock = threading.RLock()
+        self._threads = threading.local()
+        self._bus_position = None
+        self._writes = 0
+        _instances.add(self)
+
+    def _forked(self):
+        # Соединение SQLite нельзя делить с родителем: дочерний процесс
+        # открывает своё и читает шину как отдельный процесс.
+        self.origin = f'{os.getpid()}:{id(self)}'
+        self._lock = threading.RLock()
+        self._threads = threading.local()
+
+    # Соединения и шина
+
+    def _connection(self):
+        connection = getattr(self._threads, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.location)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.location, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._threads.connection = connection
+            self._threads.data_version = None
+            with self._lock:
+                if self._bus_position is None:
+                    self._bus_position = self._last_bus_id(connection)
+        return connection
+
+    def _sync(self):
+        """Выбрасывает из памяти ключи, которые изменили другие процессы."""
+        connection = self._connection()
+        data_version = connection.execute(
+            'PRAGMA data_version'
+        ).fetchone()[0]
+        if data_version == self._threads.data_version:
+            return
+        self._threads.data_version = data_version
+        with self._lock:
+            first = connection.execute(
+                'SELECT MIN(id) FROM cache_bus'
+            ).fetchone()[0]
+            if first is not None and first > self._bus_position + 1:
+                # Журнал обрезан дальше нашей позиции: часть
+                # инвалидаций потеряна, доверять памяти нельзя.
+                self._local.clear()
+            rows = connection.execute(
+                'SELECT id, key, origin FROM cache_bus WHERE id > ?',
+                (self._bus_position,),
+            ).fetchall()
+            for bus_id, key, origin in rows:
+                if key == CLEAR_ALL:
+                    self._local.clear()
+                elif origin != self.origin:
+                    self._local.pop(key, None)
+                self._bus_position = bus_id
+
+    @staticmethod
+    def _last_bus_id(connection):
+        return connection.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM cache_bus'
+        ).fetchone()[0]
+
+    def _publish(self, connection, keys):
+        connection.executemany(
+            'INSERT INTO cache_bus (key, origin) VALUES (?, ?)',
+            [(key, self.origin) for key in keys],
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            last = self._last_bus_id(connection)
+            connection.execute(
+                'DELETE FROM cache_bus WHERE id <= ?', (last - self.bus_keep,)
+            )
+            connection.execute(
+                'DELETE FROM cache_entry WHERE expires < ?', (time.time(),)
+            )
+
+    def _write(self, statements, keys):
+        """Выполняет запись в одной транзакции и публикует ключи.
+
+        statements может класть новые значения в память: пока транзакция
+        держит блокировку записи, другие процессы не запишут более новые.
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(connection)
+            self._publish(connection, keys)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            self._forget(keys)
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    # Память процесса
+
+    def _remember(self, key, value, expires):
+        with self._lock:
+            self._local[key] = (value, expires)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
+
+    def _forget(self, keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def _expires(self, timeout):
+        # Время истечения в секундах эпохи или None для вечных ключей.
+        return self.get_backend_timeout(timeout)
+
+    @staticmethod
+    def _alive(expires):
+        return expires is None or expires > time.time()
+
+    def _fetch(self, key):
+        """Сырые (value, expires) из памяти или общего хранилища."""
+        self._sync()
+        with self._lock:
+            position = self._bus_position
+            entry = self._local.get(key)
+            if entry is not None:
+                if self._alive(entry[1]):
+                    self._local.move_to_end(key)
+                    return entry
+                del self._local[key]
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache_entry WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or not self._alive(row[1]):
+            return None
+        with self._lock:
+            # Если другой поток уже прочитал шину дальше, строка могла
+            # устареть после его проверки: в память её не кладём.
+            if self._bus_position == position:
+                self._remember(key, row[0], row[1])
+        return row
+
+    # API кэша Django
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        entry = self._fetch(key)
+        if entry is None:
+            return default
+        return pickle.loads(entry[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expires(timeout)
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append((
+                key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires
+            ))
+        if not rows:
+            return []
+
+        def replace(connection):
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache_entry (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                rows,
+            )
+            for key, value, expires in rows:
+                self._remember(key, value, expires)
+
+        self._write(replace, [row[0] for row in rows])
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self._expires(timeout)
+
+        def insert(connection):
+            connection.execute(
+                'DELETE FROM cache_entry WHERE key = ? AND expires < ?',
+                (key, time.time()),
+            )
+            added = connection.execute(
+                'INSERT OR IGNORE INTO cache_entry (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                (key, value, expires),
+            ).rowcount == 1
+            if added:
+                self._remember(key, value, expires)
+            return added
+
+        self._forget([key])
+        return self._write(insert, [key])
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        def update(connection):
+            row = connection.execute(
+                'SELECT value, expires FROM cache_entry WHERE key = ?',
+                (key,),
+            ).fetchone()
+            if row is None or not self._alive(row[1]):
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            connection.execute(
+                'UPDATE cache_entry SET value = ? WHERE key = ?',
+                (pickled, key),
+            )
+            self._remember(key, pickled, row[1])
+            return value
+
+        return self._write(update, [key])
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        expires = self._expires(timeout)
+        touched = self._write(lambda connection: connection.execute(
+            'UPDATE cache_entry SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (expires, key, time.time()),
+        ).rowcount == 1, [key])
+        self._forget([key])
+        return touched
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+        if not keys:
+            return
+        self._write(lambda connection: connection.executemany(
+            'DELETE FROM cache_entry WHERE key = ?',
+            [(key,) for key in keys],
+        ), keys)
+        self._forget(keys)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._fetch(key) is not None
+
+    def clear(self):
+        self._write(
+            lambda connection: connection.execute('DELETE FROM cache_entry'),
+            [CLEAR_ALL],
+        )
+        with self._lock:
+            self._local.clear()
+
+    def close(self, **kwargs):
+        # Соединения SQLite живут с потоком: закрывать их после каждого
+        # запроса значит терять быструю проверку data_version.
+        pass
@@ -0,0 +1,34 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+def temp_cache_settings(directory):
+    """override_settings, переносящий все кэши в каталог directory."""
+    return override_settings(CACHES={
+        alias: {**config, 'LOCATION': f'{directory}/{alias}'}
+        for alias, config in settings.CACHES.items()
+    })
+
+
+class TempCacheRunner(DiscoverRunner):
+    """Запускает тесты с кэшем во временном файле.
+
+    Иначе cache.clear() в тестах стирал бы общий кэш SQLite из
+    настроек, а тесты видели бы записи, оставшиеся от сервера. Для
+    pytest то же делает conftest.py в корне репозитория.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_directory = tempfile.mkdtemp(prefix='yatube-cache-')
+        self._cache_settings = temp_cache_settings(self._cache_directory)
+        self._cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_settings.disable()
+        shutil.rmtree(self._cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,97 @@
+import gc
+import os
+import shutil
+import tempfile
+import time
+import weakref
+
+from django.test import SimpleTestCase
+
+from ..cache import TwoTierCache
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.first = self.worker()
+        self.second = self.worker()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def worker(self, **options):
+        """Отдельный экземпляр бэкенда ведёт себя как другой воркер."""
+        return TwoTierCache(self.location, {'OPTIONS': options})
+
+    def test_cache_api(self):
+        """Бэкенд поддерживает основные операции кэша Django"""
+        self.first.set('key', {'value': 1})
+        self.assertEqual(self.first.get('key'), {'value': 1})
+        self.assertFalse(self.first.add('key', 'other'))
+        self.assertTrue(self.first.add('new', 1))
+        self.assertEqual(self.first.incr('new', 5), 6)
+        with self.assertRaises(ValueError):
+            self.first.incr('missing')
+        self.assertEqual(
+            self.first.get_many(['key', 'new', 'missing']),
+            {'key': {'value': 1}, 'new': 6})
+        self.first.delete('key')
+        self.assertIsNone(self.first.get('key'))
+        self.first.set('short', 1, timeout=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.first.get('short'))
+        self.assertTrue(self.first.add('short', 2))
+
+    def test_dropped_instance_is_collected(self):
+        """Экземпляр потока не удерживается хуком после fork"""
+        worker = self.worker()
+        worker.set('key', 1)
+        reference = weakref.ref(worker)
+        del worker
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_writes_reach_other_workers(self):
+        """Запись одного воркера сбрасывает копию в памяти другого"""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.set('n', 1)
+        self.assertEqual(self.second.get('n'), 1)
+        self.first.incr('n')
+        self.assertEqual(self.second.get('n'), 2)
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+        self.first.clear()
+        self.assertIsNone(self.second.get('n'))
+
+    def test_hot_key_is_served_from_memory(self):
+        """Повторное чтение без чужих записей не обращается к SQLite"""
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        statements = []
+        self.second._connection().set_trace_callback(statements.append)
+        for _ in range(10):
+            self.assertEqual(self.second.get('key'), 'value')
+        self.assertFalse(
+            [sql for sql in statements if 'cache_entry' in sql])
+
+    def test_local_memory_is_bounded(self):
+        """Память процесса хранит не больше LOCAL_MAX_ENTRIES ключей"""
+        worker = self.worker(LOCAL_MAX_ENTRIES=2)
+        for key in ('a', 'b', 'c'):
+            worker.set(key, key)
+        self.assertEqual(len(worker._local), 2)
+        self.assertEqual(worker.get('a'), 'a')
+
+    def test_lagging_worker_drops_memory(self):
+        """Воркер, отставший от обрезанной шины, очищает память"""
+        writer = self.worker(BUS_KEEP=10)
+        self.second.set('key', 'old')
+        self.second.get('key')
+        writer.set('key', 'new')
+        for i in range(200):
+            writer.set(f'other{i}', i)
+        self.assertEqual(self.second.get('key'), 'new')
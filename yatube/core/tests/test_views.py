@@ -0,0 +1,40 @@
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.test import RequestFactory, TestCase
+
+from ..views import (csrf_failure, error_page, page_not_found,
+                     permission_denied, server_error, warm_error_pages)
+
+
+class ErrorPagesTests(TestCase):
+    def setUp(self):
+        warm_error_pages()
+        self.request = RequestFactory().get('/bad/<script>/')
+
+    def test_error_pages_are_served_without_database(self):
+        """Обработчики отдают готовые страницы без запросов к базе"""
+        handlers = (
+            (lambda r: page_not_found(r, Http404()), 404, 'Custom 404'),
+            (lambda r: permission_denied(r, PermissionDenied()), 403,
+             'Custom 403'),
+            (csrf_failure, 403, 'Custom CSRF check error'),
+            (server_error, 500, 'Custom 500'),
+        )
+        for handler, status, title in handlers:
+            with self.subTest(status=status, title=title):
+                with self.assertNumQueries(0):
+                    response = handler(self.request)
+                self.assertEqual(response.status_code, status)
+                self.assertIn(title, response.content.decode())
+
+    def test_path_is_escaped(self):
+        """Путь запроса подставляется в страницу экранированным"""
+        content = page_not_found(self.request, Http404()).content.decode()
+        self.assertIn('/bad/&lt;script&gt;/', content)
+        self.assertNotIn('<script>', content)
+
+    def test_broken_template_falls_back_to_plain_page(self):
+        """Без шаблона отдаётся минимальная страница с кодом ошибки"""
+        with self.assertLogs('core.views', 'ERROR'):
+            content = error_page('core/missing.html', self.request, 500)
+        self.assertIn(b'<h1>500</h1>', content)
@@ -1,45 +1,81 @@
-from django.shortcuts import render
+import logging
+
+from django.http import (HttpResponseForbidden, HttpResponseNotFound,
+                         HttpResponseServerError)
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+from .context_processors.year import year
+
+# Место пути запроса в заранее отрисованной странице
+ERROR_PATH = 'yatube-error-page-path'
+ERROR_TEMPLATES = (
+    'core/404.html', 'core/403.html', 'core/403csrf.html', 'core/500.html',
+)
+# Отдаётся, если не удалось отрисовать даже страницу ошибки
+FALLBACK_PAGE = '<!DOCTYPE html><title>Yatube</title><h1>{}</h1>'
+_error_pages = {}
+
+logger = logging.getLogger(__name__)
+
+
+def prerendered(template):
+    """Байты страницы template, разрезанные по местам для пути.
+
+    Страница рисуется один раз на процесс для анонимного зрителя, без
+    запроса: ошибки, которыми боты заваливают сайт, не рендерят шаблоны
+    и не ходят в базу за сессией.
+    """
+    context = year(None)
+    key = template, context['year']
+    parts = _error_pages.get(key)
+    if parts is None:
+        html = render_to_string(template, {**context, 'path': ERROR_PATH})
+        parts = _error_pages[key] = [
+            part.encode() for part in html.split(ERROR_PATH)
+        ]
+    return parts
+
+
+def warm_error_pages():
+    """Отрисовывает страницы ошибок при старте процесса."""
+    for template in ERROR_TEMPLATES:
+        prerendered(template)
+
+
+def error_page(template, request, status):
+    """Страница ошибки с экранированным путём запроса.
+
+    Под перегрузкой падает и сам обработчик 500: если шаблон не
+    отрисовался, отдаётся минимальная страница без шаблонов.
+    """
+    try:
+        parts = prerendered(template)
+    except Exception:
+        logger.exception('Не удалось отрисовать %s', template)
+        return FALLBACK_PAGE.format(status).encode()
+    return escape(request.path).encode().join(parts)
 
 
 def page_not_found(request, exception):
-    """Description."""
-    return render(
-        request,
-        'core/404.html',
-        {
-            'path': request.path,
-        },
-        status=404,
-    )
+    """Страница 404."""
+    return HttpResponseNotFound(error_page('core/404.html', request, 404))
 
 
 def csrf_failure(request, reason=''):
-    """Description."""
-    return render(
-        request,
-        'core/403csrf.html'
+    """Страница 403 при ошибке проверки CSRF."""
+    return HttpResponseForbidden(
+        error_page('core/403csrf.html', request, 403)
     )
 
 
 def permission_denied(request, exception):
-    """Description."""
-    return render(
-        request,
-        'core/403.html',
-        {
-            'path': request.path,
-        },
-        status=403,
-    )
+    """Страница 403."""
+    return HttpResponseForbidden(error_page('core/403.html', request, 403))
 
 
 def server_error(request):
-    """Description."""
-    return render(
-        request,
-        'core/500.html',
-        {
-            'path': request.path,
-        },
-        status=500,
+    """Страница 500."""
+    return HttpResponseServerError(
+        error_page('core/500.html', request, 500)
     )
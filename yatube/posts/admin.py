@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Post, Group, Comment, Likes
+from .models import Post, Group, Comment, Likes, ThumbnailJob
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -22,7 +22,14 @@ class LikesAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+class ThumbnailJobAdmin(admin.ModelAdmin):
+    list_display = ('post', 'attempts', 'run_after', 'last_error',)
+    list_filter = ('attempts',)
+    empty_value_display = '-пусто-'
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Likes, LikesAdmin)
+admin.site.register(ThumbnailJob, ThumbnailJobAdmin)
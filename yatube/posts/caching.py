@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+FEED_VERSION_KEY = 'posts:version:{}'
+FEED_MODIFIED_KEY = 'posts:modified:{}'
+CACHE_STATS_KEY = 'posts:stats:{}:{}'
+CACHE_STATS_EVENTS = ('hit', 'miss', 'stale')
+# Кэши, по которым команда cache_stats показывает попадания
+INSTRUMENTED_CACHES = (
+    'feed_page', 'feed_count', 'feed_fragment', 'post_card', 'identity',
+    'key_filter',
+)
+REBUILD_LOCK_KEY = '{}:lock'
+
+logger = logging.getLogger(__name__)
+
+
+def _initial_version():
+    # Версия растёт монотонно и после вытеснения ключа из кэша: новое
+    # значение берётся из часов, поэтому старые страницы не оживают.
+    return int(time.time() * 1000)
+
+
+def feed_version(key):
+    """Текущая версия ленты key."""
+    cache_key = FEED_VERSION_KEY.format(key)
+    version = cache.get(cache_key)
+    if version is None:
+        cache.add(cache_key, _initial_version(), None)
+        version = cache.get(cache_key)
+    return version
+
+
+def feed_versions(keys):
+    """Текущие версии лент keys одним чтением из кэша."""
+    values = cache.get_many([FEED_VERSION_KEY.format(key) for key in keys])
+    return [
+        values.get(FEED_VERSION_KEY.format(key)) or feed_version(key)
+        for key in keys
+    ]
+
+
+def bump_feed_versions(keys):
+    """Увеличивает версии лент: закэшированные страницы перестают читаться."""
+    keys = list(keys)
+    for key in keys:
+        cache_key = FEED_VERSION_KEY.format(key)
+        try:
+            cache.incr(cache_key)
+        except ValueError:
+            cache.add(cache_key, _initial_version(), None)
+    now = int(time.time())
+    cache.set_many({FEED_MODIFIED_KEY.format(key): now for key in keys}, None)
+
+
+def feed_state(keys):
+    """Версии лент и время последнего изменения одним чтением из кэша.
+
+    Если время изменения вытеснено из кэша, ленты считаются изменёнными
+    сейчас: клиент получит страницу целиком, а не устаревший 304.
+    """
+    values = cache.get_many(
+        [FEED_VERSION_KEY.format(key) for key in keys]
+        + [FEED_MODIFIED_KEY.format(key) for key in keys]
+    )
+    versions = [
+        values.get(FEED_VERSION_KEY.format(key)) or feed_version(key)
+        for key in keys
+    ]
+    modified = []
+    for key in keys:
+        value = values.get(FEED_MODIFIED_KEY.format(key))
+        if value is None:
+            value = int(time.time())
+            cache.add(FEED_MODIFIED_KEY.format(key), value, None)
+        modified.append(value)
+    return versions, max(modified)
+
+
+def condition_on_feeds(state):
+    """Условный GET по версиям лент вместо рендеринга страницы.
+
+    state(request, *args, **kwargs) возвращает (keys, last_modified) или
+    None, если страницу нужно отдать как есть. ETag складывается из
+    версий лент и cookie сессии и CSRF: страница зависит от зрителя.
+    """
+    def decorator(view):
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            result = state(request, *args, **kwargs)
+            if result is None:
+                return view(request, *args, **kwargs)
+            keys, last_modified = result
+            versions, modified = feed_state(keys)
+            if last_modified is not None:
+                modified = max(modified, int(last_modified.timestamp()))
+            viewer = (
+                request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+                request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            )
+            etag = quote_etag(md5(
+                repr((keys, versions, viewer)).encode()
+            ).hexdigest())
+            response = get_conditional_response(
+                request, etag=etag, last_modified=modified
+            )
+            if response is None:
+                response = view(request, *args, **kwargs)
+                # Пока страницу пересобирает другой воркер, отдан старый
+                # вариант: валидаторы текущей версии ему не подходят.
+                stale = getattr(request, 'served_stale', False)
+                if response.status_code == 200 and not stale:
+                    response.setdefault('ETag', etag)
+                    response.setdefault('Last-Modified', http_date(modified))
+            return response
+        return inner
+    return decorator
+
+
+# События кэшей, ещё не записанные в кэш: попадание должно оставаться
+# чтением, поэтому счётчики копятся в процессе и записываются не чаще
+# раза в CACHE_STATS_FLUSH_INTERVAL секунд
+_pending_stats = Counter()
+_pending_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def _forget_pending_stats():
+    # Счётчики родителя запишет сам родитель.
+    _pending_stats.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pending_stats)
+
+
+def record(name, event):
+    """Считает события кэша name: hit, miss или stale."""
+    logger.debug('cache %s: %s', name, event)
+    with _pending_lock:
+        _pending_stats[name, event] += 1
+        due = (time.monotonic() - _flushed_at
+               >= settings.CACHE_STATS_FLUSH_INTERVAL)
+    if due:
+        flush_cache_stats()
+
+
+def flush_cache_stats():
+    """Записывает накопленные в процессе счётчики событий в кэш."""
+    global _flushed_at
+    with _pending_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+        _flushed_at = time.monotonic()
+    for (name, event), count in pending.items():
+        cache_key = CACHE_STATS_KEY.format(name, event)
+        try:
+            cache.incr(cache_key, count)
+        except ValueError:
+            cache.add(cache_key, 0, None)
+            cache.incr(cache_key, count)
+
+
+def single_flight(key, version, build, name, soft_timeout, hard_timeout):
+    """Значение версии version из кэша; пересобирает его один воркер.
+
+    В кэше лежит (version, soft_expires, value). Запись свежая, пока
+    версия совпадает и не прошёл soft_timeout. Устаревшую запись
+    пересобирает тот, кто взял блокировку, остальные до конца
+    пересборки получают старое значение. Без старого значения они
+    ждут сборщика не дольше CACHE_REBUILD_WAIT. Через hard_timeout
+    запись удаляется из кэша совсем.
+
+    Возвращает (value, version, stale), где version — версия значения.
+    """
+    def fresh(entry):
+        return (entry is not None and entry[0] == version
+                and entry[1] > time.time())
+
+    entry = cache.get(key)
+    if fresh(entry):
+        record(name, 'hit')
+        return entry[2], version, False
+    lock_key = REBUILD_LOCK_KEY.format(key)
+    if not cache.add(lock_key, True, settings.CACHE_REBUILD_LOCK_TIMEOUT):
+        if entry is not None:
+            record(name, 'stale')
+            return entry[2], entry[0], True
+        deadline = time.time() + settings.CACHE_REBUILD_WAIT
+        while time.time() < deadline:
+            time.sleep(0.02)
+            entry = cache.get(key)
+            if fresh(entry):
+                record(name, 'hit')
+                return entry[2], version, False
+        # Сборщик не успел: считаем сами, но кэш ему не перебиваем.
+        record(name, 'miss')
+        return build(), version, False
+    try:
+        # Предыдущий сборщик мог закончить между чтением и блокировкой.
+        entry = cache.get(key)
+        if fresh(entry):
+            record(name, 'hit')
+            return entry[2], version, False
+        record(name, 'miss')
+        value = build()
+        cache.set(
+            key, (version, time.time() + soft_timeout, value), hard_timeout
+        )
+    finally:
+        cache.delete(lock_key)
+    return value, version, False
+
+
+def cache_stats(names):
+    """Словарь {name: (hits, misses, stale)} по накопленным счётчикам.
+
+    Счётчики других процессов видны с задержкой до
+    CACHE_STATS_FLUSH_INTERVAL.
+    """
+    flush_cache_stats()
+    keys = [
+        CACHE_STATS_KEY.format(name, event)
+        for name in names for event in CACHE_STATS_EVENTS
+    ]
+    values = cache.get_many(keys)
+    return {
+        name: tuple(
+            values.get(CACHE_STATS_KEY.format(name, event), 0)
+            for event in CACHE_STATS_EVENTS
+        )
+        for name in names
+    }
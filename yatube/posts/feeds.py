@@ -0,0 +1,371 @@
+import heapq
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import bump_feed_versions, feed_version
+from .models import AuthorStats, Follow, Likes, Post, Timeline
+from .units import MESSAGE_N, QuerySetFeed
+
+FAN_OUT_BATCH = 500
+CELEBRITIES_CACHE_KEY = 'posts:celebrities'
+FOLLOWING_CACHE_KEY = 'posts:following:{}'
+
+logger = logging.getLogger(__name__)
+
+
+def celebrity_ids():
+    """Авторы-знаменитости, см. update_celebrity.
+
+    Их посты не раскладываются по лентам, а подтягиваются при чтении.
+    """
+    ids = cache.get(CELEBRITIES_CACHE_KEY)
+    if ids is None:
+        ids = frozenset(
+            AuthorStats.objects.filter(
+                celebrity_since__isnull=False
+            ).values_list('user_id', flat=True)
+        )
+        cache.set(
+            CELEBRITIES_CACHE_KEY, ids, settings.FEED_CELEBRITIES_TIMEOUT
+        )
+    return ids
+
+
+def following_ids(user_id):
+    """Авторы, на которых подписан пользователь.
+
+    Кэшируются под версией ленты follow:{user_id}, которую меняют
+    подписка и отписка.
+    """
+    version = feed_version(f'follow:{user_id}')
+    cache_key = FOLLOWING_CACHE_KEY.format(user_id)
+    entry = cache.get(cache_key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    ids = list(Follow.objects.filter(
+        user_id=user_id
+    ).values_list('author_id', flat=True))
+    cache.set(cache_key, (version, ids), settings.FEED_PAGE_CACHE_TIMEOUT)
+    return ids
+
+
+def is_celebrity(author_id):
+    return author_id in celebrity_ids()
+
+
+def update_celebrity(author_id):
+    """Переводит автора в знаменитости и обратно после смены подписок.
+
+    Автор становится знаменитостью с FEED_CELEBRITY_FOLLOWERS подписчиков
+    и перестаёт ею быть, когда их меньше доли FEED_CELEBRITY_LEAVE от
+    порога: зазор не даёт автору на границе переключаться на каждой
+    подписке. Переход отмечается условным UPDATE, поэтому его выполняет
+    ровно один из параллельных запросов. Набор знаменитостей
+    сбрасывается сразу, а не через FEED_CELEBRITIES_TIMEOUT: иначе посты,
+    опубликованные в это окно, не попали бы ни в ленты, ни в прямое
+    чтение.
+
+    Выход из знаменитостей только ставится в очередь: дописать посты в
+    ленты десятков тысяч подписчиков — работа для feed_worker, а не для
+    запроса на отписку, см. run_backfills.
+    """
+    stats = AuthorStats.objects.filter(user_id=author_id)
+    if stats.filter(
+        celebrity_since__isnull=True,
+        followers_count__gte=settings.FEED_CELEBRITY_FOLLOWERS,
+    ).update(celebrity_since=timezone.now()):
+        cache.delete(CELEBRITIES_CACHE_KEY)
+        return
+    stats.filter(
+        celebrity_since__isnull=False,
+        backfill_after__isnull=True,
+        followers_count__lt=leave_threshold(),
+    ).update(backfill_after=timezone.now())
+
+
+def leave_threshold():
+    return settings.FEED_CELEBRITY_FOLLOWERS * settings.FEED_CELEBRITY_LEAVE
+
+
+def claim_backfills(limit):
+    """Забирает до limit авторов, ожидающих выхода из знаменитостей.
+
+    Как и задачи миниатюр, автор достаётся одному воркеру условным
+    UPDATE и откладывается на FEED_BACKFILL_LEASE: если воркер упадёт,
+    автора возьмут снова. Возвращает пары (author_id, celebrity_since).
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.FEED_BACKFILL_LEASE)
+    claimed = []
+    for author_id, since, after in AuthorStats.objects.filter(
+        backfill_after__lte=now
+    ).order_by('backfill_after').values_list(
+        'user_id', 'celebrity_since', 'backfill_after'
+    )[:limit]:
+        if AuthorStats.objects.filter(
+            user_id=author_id, backfill_after=after
+        ).update(backfill_after=lease):
+            claimed.append((author_id, since))
+    return claimed
+
+
+def leave_celebrities(author_id, since):
+    """Дописывает посты автора в ленты и выводит его из знаменитостей.
+
+    Пока посты дописываются, автор остаётся знаменитостью и читается
+    напрямую. Если подписчики за это время вернулись, он ею и остаётся.
+    Возвращает True, если автор вышел из знаменитостей.
+    """
+    started = timezone.now()
+    backfill_followers(author_id, since)
+    stats = AuthorStats.objects.filter(
+        user_id=author_id, celebrity_since=since)
+    if not stats.filter(followers_count__lt=leave_threshold()).update(
+        celebrity_since=None, backfill_after=None
+    ):
+        stats.update(backfill_after=None)
+        return False
+    cache.delete(CELEBRITIES_CACHE_KEY)
+    # Посты, опубликованные во время дополнения, ещё не разложены.
+    backfill_followers(author_id, started)
+    return True
+
+
+def run_backfills(limit):
+    """Выводит из знаменитостей до limit авторов; число обработанных."""
+    claimed = claim_backfills(limit)
+    for author_id, since in claimed:
+        try:
+            leave_celebrities(author_id, since)
+        except Exception:
+            # Автор останется в очереди до конца FEED_BACKFILL_LEASE.
+            logger.exception(
+                'Не удалось дополнить ленты подписчиков автора %s',
+                author_id)
+    return len(claimed)
+
+
+def feed_keys(post, group_ids=()):
+    """Ключи лент, в которые попадает пост.
+
+    group_ids добавляет группы, из которых пост ушёл при редактировании.
+    """
+    keys = {'index', f'profile:{post.author_id}'}
+    keys.update(
+        f'group:{group_id}'
+        for group_id in {post.group_id, *group_ids} if group_id is not None
+    )
+    return keys
+
+
+def refresh_cards(posts, keys=()):
+    """Устаревают карточки постов posts и страницы лент с ними.
+
+    Нужна, когда меняются автор или группа, которых видно в карточке:
+    новый updated_at меняет ключ карточки, а версии лент сбрасывают
+    закэшированные строки страниц, откуда этот ключ берётся.
+    """
+    rows = list(posts.values_list('pk', 'author_id', 'group_id'))
+    keys = set(keys)
+    if rows:
+        Post.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(
+            updated_at=timezone.now())
+        authors = {author_id for _, author_id, _ in rows}
+        keys.add('index')
+        keys.update(f'profile:{author_id}' for author_id in authors)
+        keys.update(
+            f'group:{group_id}' for _, _, group_id in rows
+            if group_id is not None
+        )
+    bump_feed_versions(keys)
+
+
+def mark_liked(posts, user):
+    """Отмечает одним запросом посты, которые лайкнул пользователь."""
+    liked = set()
+    if user.is_authenticated and posts:
+        liked = set(Likes.objects.filter(
+            user=user, post_id__in=[post.pk for post in posts]
+        ).values_list('post_id', flat=True))
+    for post in posts:
+        post.is_liked = post.pk in liked
+
+
+def timeline_feed(user):
+    """Лента подписок, читаемая из материализованной ленты пользователя."""
+    return QuerySetFeed(
+        Post.objects.for_feed(),
+        where=Q(timeline__user=user),
+        key_fields=('timeline__pub_date', 'timeline__post_id'),
+    )
+
+
+class HybridFeed:
+    """Лента подписок: материализованная лента плюс посты знаменитостей.
+
+    Обычные авторы раскладывают посты по лентам подписчиков при
+    публикации, посты знаменитостей читаются напрямую по индексу автора.
+    Отсортированные потоки сливаются k-путевым слиянием.
+
+    Публикация не трогает версии лент подписчиков: версия числа записей
+    складывается при чтении из версий профилей авторов, см. version_keys.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.author_ids = following_ids(user.pk)
+        celebrities = celebrity_ids()
+        self.streams = [timeline_feed(user)] + [
+            QuerySetFeed(
+                Post.objects.for_feed().filter(author_id=author_id)
+            )
+            for author_id in self.author_ids if author_id in celebrities
+        ]
+
+    def version_keys(self):
+        """Ленты, от которых зависит число записей: профили авторов."""
+        return [f'profile:{author_id}' for author_id in self.author_ids]
+
+    def count(self, limit=None):
+        return sum(stream.count(limit=limit) for stream in self.streams)
+
+    def window(self, after=None, before=None, offset=0, limit=MESSAGE_N):
+        streams = [
+            stream.window(after=after, before=before, limit=offset + limit)
+            for stream in self.streams
+        ]
+        merged = heapq.merge(
+            *streams,
+            key=lambda post: (post.pub_date, post.pk),
+            reverse=before is None,
+        )
+        rows, seen = [], set()
+        for post in merged:
+            # Посты знаменитости, опубликованные до перехода или до
+            # подписки, лежат в ленте и приходят из прямого чтения.
+            if post.pk in seen:
+                continue
+            seen.add(post.pk)
+            rows.append(post)
+            if len(rows) == offset + limit:
+                break
+        return rows[offset:]
+
+
+def trim_timelines(user_ids):
+    """Оставляет в лентах пользователей не больше TIMELINE_MAX_ENTRIES
+    записей одним запросом на всю порцию.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    table = connection.ops.quote_name(Timeline._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f' SELECT id FROM ('
+            f'  SELECT id, ROW_NUMBER() OVER ('
+            f'   PARTITION BY user_id ORDER BY pub_date DESC, post_id DESC'
+            f'  ) AS position FROM {table} WHERE user_id IN ({placeholders})'
+            f' ) AS ranked WHERE position > %s)',
+            [*user_ids, settings.TIMELINE_MAX_ENTRIES],
+        )
+
+
+def trim_timeline(user_id):
+    """Оставляет в ленте пользователя не больше TIMELINE_MAX_ENTRIES."""
+    trim_timelines([user_id])
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_celebrity(post.author_id):
+        return
+    follower_ids = list(
+        Follow.objects.filter(author_id=post.author_id).values_list(
+            'user_id', flat=True
+        )
+    )
+    for start in range(0, len(follower_ids), FAN_OUT_BATCH):
+        batch = follower_ids[start:start + FAN_OUT_BATCH]
+        Timeline.objects.bulk_create(
+            (Timeline(user_id=user_id, post=post, pub_date=post.pub_date)
+             for user_id in batch),
+            ignore_conflicts=True,
+        )
+        trim_timelines(batch)
+
+
+def backfill_followers(author_id, since):
+    """Раскладывает по лентам подписчиков посты автора с момента since.
+
+    Вызывается, когда автор перестаёт быть знаменитостью: его посты за
+    это время не раскладывались, а прямое чтение больше их не отдаёт.
+    """
+    posts = list(Post.objects.filter(
+        author_id=author_id, pub_date__gte=since
+    ).order_by('-pub_date', '-pk').values_list(
+        'pk', 'pub_date'
+    )[:settings.TIMELINE_MAX_ENTRIES])
+    if not posts:
+        return
+    follower_ids = list(
+        Follow.objects.filter(author_id=author_id).values_list(
+            'user_id', flat=True
+        )
+    )
+    for start in range(0, len(follower_ids), FAN_OUT_BATCH):
+        batch = follower_ids[start:start + FAN_OUT_BATCH]
+        Timeline.objects.bulk_create(
+            (Timeline(user_id=user_id, post_id=pk, pub_date=pub_date)
+             for user_id in batch for pk, pub_date in posts),
+            ignore_conflicts=True,
+            batch_size=FAN_OUT_BATCH,
+        )
+        trim_timelines(batch)
+
+
+def backfill_timeline(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки.
+
+    Посты знаменитости тоже раскладываются: если автор перестанет ею
+    быть, backfill_followers дополнит ленту только постами, которые не
+    раскладывались с момента перехода.
+    """
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:settings.TIMELINE_MAX_ENTRIES]
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in posts),
+        ignore_conflicts=True,
+    )
+    trim_timeline(user_id)
+
+
+def drop_from_timeline(user_id, author_id):
+    """Убирает посты автора из ленты после отписки."""
+    Timeline.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild_timeline(user_id):
+    """Собирает ленту пользователя заново по его подпискам."""
+    Timeline.objects.filter(user_id=user_id).delete()
+    posts = Post.objects.filter(
+        author__following__user_id=user_id
+    ).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:settings.TIMELINE_MAX_ENTRIES]
+    Timeline.objects.bulk_create(
+        Timeline(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts
+    )
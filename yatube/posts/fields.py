@@ -0,0 +1,26 @@
+import json
+
+from django.db import models
+
+
+class JSONTextField(models.TextField):
+    """Словарь или список, который хранится в текстовой колонке как JSON.
+
+    В Django 2.2 JSONField есть только для PostgreSQL.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            return json.loads(value) if value else None
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self.value_from_object(obj))
@@ -1,5 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+
 from .models import Post, Comment
+from .uploads import ingest_image
 
 
 class PostForm(forms.ModelForm):
@@ -16,6 +19,15 @@ class PostForm(forms.ModelForm):
             'image': 'Загружаемая картинка',
         }
 
+    def clean_image(self):
+        """Новая картинка уменьшается и очищается от EXIF до сохранения;
+        уже сохранённая и её удаление остаются как есть.
+        """
+        image = self.cleaned_data['image']
+        if isinstance(image, UploadedFile):
+            return ingest_image(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,80 @@
+"""Кэш поиска авторов по username и групп по slug.
+
+Профили и группы открываются по имени из URL, и одни и те же популярные
+записи читаются из базы на каждом запросе. В кэше лежат кортежи полей,
+из которых модель собирается через from_db, а не pickle модели: пароль
+пользователя в кэш не попадает. Отсутствующие имена тоже кэшируются,
+но на короткий срок. Память процесса ограничена LRU бэкенда кэша,
+общее хранилище — сроками жизни ключей.
+"""
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+
+from .caching import record
+from .models import Group, User
+from .negative import may_exist
+
+IDENTITY_CACHE_KEY = 'posts:identity:{}:{}'
+IDENTITY_CACHE = 'identity'
+# Поле поиска и поля, которые нужны страницам, для каждой модели
+IDENTITY_FIELDS = {
+    User: ('username', ('id', 'username', 'first_name', 'last_name')),
+    Group: ('slug', ('id', 'title', 'slug', 'description')),
+}
+# Так кэшируется имя, которого нет в базе
+MISSING = ()
+
+
+def identity_key(model, value):
+    return IDENTITY_CACHE_KEY.format(
+        model._meta.model_name, md5(value.encode()).hexdigest()
+    )
+
+
+def lookup(model, value):
+    """Экземпляр model по полю поиска или None, через кэш."""
+    field, fields = IDENTITY_FIELDS[model]
+    cache_key = identity_key(model, value)
+    row = cache.get(cache_key)
+    record(IDENTITY_CACHE, 'miss' if row is None else 'hit')
+    if row is None:
+        # Отказ фильтра не кэшируется: при переборе ключей кэш
+        # заполнился бы одними промахами.
+        if not may_exist(model._meta.model_name, value):
+            return None
+        row = model.objects.filter(**{field: value}).values_list(
+            *fields
+        ).first() or MISSING
+        cache.set(cache_key, row, (
+            settings.IDENTITY_CACHE_TIMEOUT if row
+            else settings.IDENTITY_MISS_TIMEOUT
+        ))
+    if row == MISSING:
+        return None
+    return model.from_db(DEFAULT_DB_ALIAS, fields, row)
+
+
+def lookup_or_404(model, value):
+    instance = lookup(model, value)
+    if instance is None:
+        raise Http404
+    return instance
+
+
+def get_user_or_404(username):
+    return lookup_or_404(User, username)
+
+
+def get_group_or_404(slug):
+    return lookup_or_404(Group, slug)
+
+
+def forget(model, values):
+    """Сбрасывает кэш для значений поля поиска."""
+    cache.delete_many([
+        identity_key(model, value) for value in set(values) if value
+    ])
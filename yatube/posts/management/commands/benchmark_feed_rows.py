@@ -0,0 +1,81 @@
+import pickle
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Group, Post, User
+from posts.rows import FeedRow
+from posts.units import MESSAGE_N
+
+PREFIX = 'bench_rows_'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает размер закэшированной страницы ленты и время её '
+        'чтения из pickle для моделей Post и компактных строк. Данные '
+        'откатываются после замера.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=50)
+        parser.add_argument('--per-page', type=int, default=MESSAGE_N)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                pages = self.seed(options)
+                self.report('models', pages, options)
+                self.report('rows', [
+                    [FeedRow.from_post(post) for post in page]
+                    for page in pages
+                ], options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        author = User.objects.create_user(
+            username=f'{PREFIX}author', first_name='Лев', last_name='Толстой'
+        )
+        group = Group.objects.create(
+            title='Замер', slug=f'{PREFIX}group', description='Замер'
+        )
+        total = options['pages'] * options['per_page']
+        Post.objects.bulk_create(
+            (Post(author=author, group=group, text=f'Пост {i} ' * 20,
+                  image='posts/small.gif')
+             for i in range(total)),
+            batch_size=500,
+        )
+        posts = list(Post.objects.for_feed().filter(
+            author=author
+        ).order_by('-pub_date', '-pk'))
+        per_page = options['per_page']
+        return [
+            posts[start:start + per_page]
+            for start in range(0, len(posts), per_page)
+        ]
+
+    def report(self, name, pages, options):
+        dumps = [
+            pickle.dumps(page, pickle.HIGHEST_PROTOCOL) for page in pages
+        ]
+        timings = []
+        for _ in range(options['repeat']):
+            for data in dumps:
+                started = time.perf_counter()
+                pickle.loads(data)
+                timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(
+            f'{name:>7}: {statistics.mean(map(len, dumps)):.0f} байт '
+            f'на страницу, чтение median '
+            f'{statistics.median(timings):.3f} ms'
+        )
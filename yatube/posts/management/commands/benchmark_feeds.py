@@ -0,0 +1,117 @@
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from posts.feeds import (CELEBRITIES_CACHE_KEY, HybridFeed, rebuild_timeline,
+                         update_celebrity)
+from posts.models import AuthorStats, Follow, Post, User
+from posts.units import MESSAGE_N
+
+PREFIX = 'bench_feed_'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает гибридную ленту подписок с JOIN по Follow и Post '
+        'на синтетических данных. Данные откатываются после замера.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=300)
+        parser.add_argument('--readers', type=int, default=30)
+        parser.add_argument('--follows', type=int, default=200,
+                            help='Подписок у каждого читателя')
+        parser.add_argument('--posts', type=int, default=30,
+                            help='Постов у каждого автора')
+        parser.add_argument('--celebrities', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options)
+                self.report('join', self.measure(self.join_read, options))
+                self.report('hybrid', self.measure(self.hybrid_read, options))
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            cache.delete(CELEBRITIES_CACHE_KEY)
+
+    def seed(self, options):
+        User.objects.bulk_create(
+            User(username=f'{PREFIX}author_{i}')
+            for i in range(options['authors'])
+        )
+        User.objects.bulk_create(
+            User(username=f'{PREFIX}reader_{i}')
+            for i in range(options['readers'])
+        )
+        authors = list(User.objects.filter(
+            username__startswith=f'{PREFIX}author_'
+        ).values_list('pk', flat=True))
+        self.readers = list(User.objects.filter(
+            username__startswith=f'{PREFIX}reader_'
+        ).values_list('pk', flat=True))
+        celebrities = authors[:options['celebrities']]
+        regular = authors[options['celebrities']:]
+        follows = []
+        for reader in self.readers:
+            followed = set(celebrities) | set(random.sample(
+                regular, min(options['follows'], len(regular))
+            ))
+            follows.extend(
+                Follow(user_id=reader, author_id=author)
+                for author in followed
+            )
+        Follow.objects.bulk_create(follows, batch_size=500)
+        Post.objects.bulk_create(
+            (Post(author_id=author, text=f'Пост {i}')
+             for i in range(options['posts']) for author in authors),
+            batch_size=500,
+        )
+        AuthorStats.objects.recount(authors + self.readers)
+        with self.settings_celebrities(len(self.readers)):
+            for author in celebrities:
+                update_celebrity(author)
+            for reader in self.readers:
+                rebuild_timeline(reader)
+
+    def settings_celebrities(self, threshold):
+        cache.delete(CELEBRITIES_CACHE_KEY)
+        return override_settings(FEED_CELEBRITY_FOLLOWERS=threshold)
+
+    def join_read(self, reader):
+        return list(Post.objects.filter(
+            author__following__user_id=reader
+        ).order_by('-pub_date', '-pk')[:MESSAGE_N])
+
+    def hybrid_read(self, reader):
+        return HybridFeed(User(pk=reader)).window(limit=MESSAGE_N)
+
+    def measure(self, read, options):
+        timings = []
+        with self.settings_celebrities(len(self.readers)):
+            for _ in range(options['repeat']):
+                for reader in self.readers:
+                    started = time.perf_counter()
+                    read(reader)
+                    timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def report(self, name, timings):
+        timings.sort()
+        self.stdout.write(
+            f'{name:>8}: median {statistics.median(timings):.2f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, '
+            f'reads {len(timings)}'
+        )
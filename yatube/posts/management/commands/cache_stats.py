@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.caching import INSTRUMENTED_CACHES, cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэшей лент.'
+
+    def handle(self, *args, **options):
+        stats = cache_stats(INSTRUMENTED_CACHES)
+        for name, (hits, misses, stale) in stats.items():
+            total = hits + misses + stale
+            ratio = (hits + stale) / total if total else 0
+            self.stdout.write(
+                f'{name}: попаданий {hits}, промахов {misses}, '
+                f'устаревших {stale}, доля попаданий {ratio:.1%}'
+            )
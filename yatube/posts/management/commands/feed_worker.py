@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts.feeds import run_backfills
+
+
+class Command(BaseCommand):
+    help = (
+        'Дописывает посты авторов, которые перестают быть знаменитостями, '
+        'в ленты их подписчиков. Можно запускать несколько процессов: '
+        'авторы между ними не повторяются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1)
+        parser.add_argument('--sleep', type=float, default=10,
+                            help='Пауза, когда очередь пуста, в секундах')
+        parser.add_argument('--once', action='store_true',
+                            help='Разобрать готовых авторов и выйти')
+
+    def handle(self, *args, **options):
+        done = 0
+        try:
+            while True:
+                close_old_connections()
+                processed = run_backfills(options['batch_size'])
+                done += processed
+                if processed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Готово: авторов обработано {done}')
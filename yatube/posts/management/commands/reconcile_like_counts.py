@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import Likes, Post
+
+
+class Command(BaseCommand):
+    help = 'Сверяет Post.like_count с таблицей лайков порциями по pk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk, checked, fixed = 0, 0, 0
+        while True:
+            with transaction.atomic():
+                posts = list(Post.objects.filter(pk__gt=last_pk).order_by(
+                    'pk'
+                ).only('pk', 'like_count')[:chunk_size])
+                if not posts:
+                    break
+                last_pk = posts[-1].pk
+                counts = dict(Likes.objects.filter(
+                    post_id__gte=posts[0].pk, post_id__lte=last_pk
+                ).values_list('post').annotate(count=Count('pk')))
+                stale = []
+                for post in posts:
+                    count = counts.get(post.pk, 0)
+                    if post.like_count != count:
+                        post.like_count = count
+                        stale.append(post)
+                Post.objects.bulk_update(stale, ['like_count'])
+            checked += len(posts)
+            fixed += len(stale)
+        self.stdout.write(f'Проверено постов: {checked}, исправлено: {fixed}')
@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import feeds
+from posts.caching import bump_feed_versions
+from posts.models import Post, ThumbnailJob
+from posts.thumbnails import is_up_to_date, render_thumbnails, save_thumbnails
+
+CHECKPOINT = os.path.join(settings.BASE_DIR, '.regenerate_thumbnails')
+
+
+def regenerate(job):
+    """Режет миниатюры одной картинки в процессе пула."""
+    pk, name, force = job
+    try:
+        return pk, render_thumbnails(name, force=force), None
+    except Exception as error:
+        return pk, None, f'{type(error).__name__}: {error}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново готовит миниатюры картинок всех постов в пуле процессов. '
+        'Готовые миниатюры текущих размеров пропускаются; прерванный '
+        'запуск продолжается с последней законченной порции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='1 — без пула, в текущем процессе')
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true',
+                            help='Резать и готовые миниатюры')
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать сначала, а не с контрольной точки')
+        parser.add_argument('--checkpoint', default=CHECKPOINT)
+
+    def handle(self, *args, **options):
+        self.checkpoint = options['checkpoint']
+        last_pk = 0 if options['restart'] else self.read_checkpoint()
+        posts = Post.objects.exclude(image='').order_by('pk').only(
+            'image', 'thumbnails', 'author', 'group'
+        )
+        total = posts.filter(pk__gt=last_pk).count()
+        if last_pk:
+            self.stdout.write(f'Продолжаем после поста {last_pk}')
+        done = skipped = failed = 0
+        started = time.perf_counter()
+        pool = None
+        if options['processes'] > 1:
+            # Дочерние процессы не должны делить соединения с базой
+            # родителя: закрываем их до fork и сразу запускаем весь пул.
+            connections.close_all()
+            pool = ProcessPoolExecutor(
+                options['processes'],
+                mp_context=multiprocessing.get_context('fork'),
+            )
+            pool.submit(os.getpid).result()
+        try:
+            while True:
+                chunk = list(
+                    posts.filter(pk__gt=last_pk)[:options['chunk_size']]
+                )
+                if not chunk:
+                    break
+                stale = [
+                    post for post in chunk
+                    if options['force'] or not is_up_to_date(post)
+                ]
+                skipped += len(chunk) - len(stale)
+                jobs = [
+                    (post.pk, post.image.name, options['force'])
+                    for post in stale
+                ]
+                results = (pool.map(regenerate, jobs) if pool
+                           else map(regenerate, jobs))
+                by_pk = {post.pk: post for post in stale}
+                keys, saved = set(), []
+                for pk, thumbnails, error in results:
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f'Пост {pk}: {error}')
+                        continue
+                    post = by_pk[pk]
+                    if save_thumbnails(post, thumbnails):
+                        keys |= feeds.feed_keys(post) | {f'post:{pk}'}
+                        saved.append(pk)
+                    done += 1
+                bump_feed_versions(keys)
+                # Задачи, в том числе исчерпавшие попытки, больше не нужны.
+                ThumbnailJob.objects.filter(post_id__in=saved).delete()
+                last_pk = chunk[-1].pk
+                self.write_checkpoint(last_pk)
+                self.progress(done, skipped, failed, total, started)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.clear_checkpoint()
+        self.stdout.write(
+            f'Готово: нарезано {done}, пропущено {skipped}, ошибок {failed}'
+        )
+
+    def progress(self, done, skipped, failed, total, started):
+        elapsed = time.perf_counter() - started
+        processed = done + skipped + failed
+        self.stdout.write(
+            f'{processed}/{total}: нарезано {done}, пропущено {skipped}, '
+            f'ошибок {failed}, {done / max(elapsed, 1e-6):.1f} картинок/с'
+        )
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint) as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def write_checkpoint(self, pk):
+        # Через временный файл: прерванная запись не портит точку.
+        with open(f'{self.checkpoint}.tmp', 'w') as checkpoint:
+            checkpoint.write(str(pk))
+        os.replace(f'{self.checkpoint}.tmp', self.checkpoint)
+
+    def clear_checkpoint(self):
+        try:
+            os.remove(self.checkpoint)
+        except FileNotFoundError:
+            pass
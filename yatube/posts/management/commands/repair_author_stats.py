@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.models import AuthorStats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику авторов порциями по pk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk, checked, fixed = 0, 0, 0
+        while True:
+            user_ids = list(User.objects.filter(pk__gt=last_pk).order_by(
+                'pk'
+            ).values_list('pk', flat=True)[:chunk_size])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+            saved = {
+                stats.pk: stats
+                for stats in AuthorStats.objects.filter(user_id__in=user_ids)
+            }
+            for stats in AuthorStats.objects.recount(user_ids):
+                old = saved.get(stats.pk)
+                if old is None or (
+                    old.posts_count, old.followers_count, old.following_count
+                ) != (
+                    stats.posts_count, stats.followers_count,
+                    stats.following_count
+                ):
+                    fixed += 1
+            checked += len(user_ids)
+        self.stdout.write(
+            f'Проверено авторов: {checked}, исправлено: {fixed}'
+        )
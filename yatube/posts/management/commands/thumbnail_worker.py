@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts.thumbnails import run_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Режет миниатюры постов из очереди задач вне веб-воркеров. '
+        'Можно запускать несколько процессов: задачи между ними не '
+        'повторяются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=2,
+                            help='Пауза, когда задач нет, в секундах')
+        parser.add_argument('--once', action='store_true',
+                            help='Разобрать готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        try:
+            while True:
+                close_old_connections()
+                results = run_jobs(options['batch_size'])
+                done += sum(results)
+                failed += len(results) - sum(results)
+                if results:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Готово: нарезано {done}, ошибок {failed}')
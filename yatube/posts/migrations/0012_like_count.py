@@ -0,0 +1,46 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+def move_likes(apps, schema_editor):
+    """Переносит лайки из Post.liked в Likes и заполняет like_count."""
+    Post = apps.get_model('posts', 'Post')
+    Likes = apps.get_model('posts', 'Likes')
+    liked = Post.liked.through.objects.values_list('user_id', 'post_id')
+    Likes.objects.all().delete()
+    Likes.objects.bulk_create(
+        Likes(user_id=user_id, post_id=post_id)
+        for user_id, post_id in liked.iterator()
+    )
+    counts = Likes.objects.values('post').annotate(count=models.Count('pk'))
+    for row in counts.iterator():
+        Post.objects.filter(pk=row['post']).update(like_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число лайков'),
+        ),
+        migrations.RunPython(move_likes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='likes',
+            name='value',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='liked',
+        ),
+        migrations.AddConstraint(
+            model_name='likes',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_like'),
+        ),
+    ]
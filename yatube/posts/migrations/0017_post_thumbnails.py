@@ -0,0 +1,19 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:29
+
+from django.db import migrations
+import posts.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_post_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnails',
+            field=posts.fields.JSONTextField(blank=True, default=dict, editable=False, verbose_name='Миниатюры'),
+        ),
+    ]
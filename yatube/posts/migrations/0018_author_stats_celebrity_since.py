@@ -0,0 +1,34 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_celebrities(apps, schema_editor):
+    """Отмечает авторов, которые уже сейчас не раскладываются по лентам.
+
+    Когда они начали ими быть, неизвестно: берётся дата регистрации, и
+    при выходе из знаменитостей ленты дополнятся последними постами.
+    """
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    for stats in AuthorStats.objects.filter(
+        followers_count__gte=settings.FEED_CELEBRITY_FOLLOWERS
+    ).select_related('user'):
+        stats.celebrity_since = stats.user.date_joined
+        stats.save(update_fields=['celebrity_since'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='celebrity_since',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Знаменитость с'),
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
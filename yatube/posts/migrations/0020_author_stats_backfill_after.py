@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_thumbnail_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='backfill_after',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Дополнить ленты после'),
+        ),
+    ]
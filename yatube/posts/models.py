@@ -1,8 +1,15 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
+from django.dispatch import Signal
+
+from .fields import JSONTextField
 
 User = get_user_model()
 
+# Отправляется после того, как Likes.toggle поменял лайк и счётчик
+like_toggled = Signal(providing_args=['user', 'post_id', 'liked'])
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200)
@@ -13,6 +20,12 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для ленты вместе с автором и группой одним запросом."""
+        return self.select_related('author', 'group')
+
+
 class Post(models.Model):
     text = models.TextField(
         verbose_name='Текст поста',
@@ -20,6 +33,9 @@ class Post(models.Model):
     pub_date = models.DateTimeField(auto_now_add=True,
                                     verbose_name='Дата публикации',
                                     )
+    updated_at = models.DateTimeField(auto_now=True,
+                                      verbose_name='Дата изменения',
+                                      )
     author = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="posts",
         verbose_name='Автор'
@@ -37,10 +53,25 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
-    liked = models.ManyToManyField(User,
-                                   default=None,
-                                   blank=True,
-                                   related_name='liked')
+    # {алиас: {'url', 'width', 'height'}} готовых миниатюр, см. thumbnails
+    thumbnails = JSONTextField(
+        'Миниатюры',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    comment_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False,
+    )
+    like_count = models.PositiveIntegerField(
+        'Число лайков',
+        default=0,
+        editable=False,
+    )
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return self.text
@@ -58,12 +89,19 @@ class Post(models.Model):
     class Meta:
         ordering = ['-pub_date']
         verbose_name_plural = 'записи', 'Авторы', 'посты'
-
-
-LIKE_CHOICES = (
-        ('Like', 'Like'),
-        ('Unlike', 'Unlike'),
-    )
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'), name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_pub_date_idx'
+            ),
+        ]
 
 
 class Comment(models.Model):
@@ -86,6 +124,12 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('created',)
+        indexes = [
+            models.Index(
+                fields=['post', 'created', 'id'],
+                name='comment_post_created_idx',
+            ),
+        ]
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
@@ -105,6 +149,18 @@ class Follow(models.Model):
         related_name='following'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'author'), name='unique_follow'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=('author', 'user'), name='follow_author_user_idx'
+            ),
+        ]
+
 
 class Likes(models.Model):
     user = models.ForeignKey(User,
@@ -114,9 +170,194 @@ class Likes(models.Model):
                              on_delete=models.CASCADE,
                              related_name='post_like'
                              )
-    value = models.CharField(choices=LIKE_CHOICES,
-                             default='Like',
-                             max_length=10)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'post'), name='unique_like'
+            ),
+        ]
 
     def __str__(self):
         return str(self.post)
+
+    @classmethod
+    def toggle(cls, user, post_id):
+        """Ставит или снимает лайк; возвращает True, если пост лайкнут.
+
+        Счётчик Post.like_count меняется в базе выражением F(), поэтому
+        одновременные лайки не теряются.
+        """
+        with transaction.atomic():
+            deleted, _ = cls.objects.filter(
+                user=user, post_id=post_id
+            ).delete()
+            if deleted:
+                delta = -1
+            else:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(user=user, post_id=post_id)
+                except IntegrityError:
+                    # Параллельный запрос уже поставил этот лайк.
+                    return True
+                delta = 1
+            Post.objects.filter(pk=post_id).update(
+                like_count=models.F('like_count') + delta
+            )
+        like_toggled.send(
+            sender=cls, user=user, post_id=post_id, liked=delta > 0
+        )
+        return delta > 0
+
+
+class Timeline(models.Model):
+    """Лента подписок пользователя, заполняемая при публикации поста."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date', '-post_id')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'post'), name='unique_timeline_post'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='timeline_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} <- {self.post_id}'
+
+
+class AuthorStatsManager(models.Manager):
+    def recount(self, user_ids):
+        """Пересчитывает статистику пользователей по исходным таблицам."""
+        user_ids = list(user_ids)
+        posts = dict(Post.objects.filter(author_id__in=user_ids).order_by(
+        ).values_list('author').annotate(count=models.Count('pk')))
+        followers = dict(Follow.objects.filter(
+            author_id__in=user_ids
+        ).order_by().values_list('author').annotate(count=models.Count('pk')))
+        following = dict(Follow.objects.filter(
+            user_id__in=user_ids
+        ).order_by().values_list('user').annotate(count=models.Count('pk')))
+        stats = [
+            AuthorStats(
+                user_id=user_id,
+                posts_count=posts.get(user_id, 0),
+                followers_count=followers.get(user_id, 0),
+                following_count=following.get(user_id, 0),
+            )
+            for user_id in user_ids
+        ]
+        with transaction.atomic():
+            existing = set(self.filter(user_id__in=user_ids).values_list(
+                'user_id', flat=True
+            ))
+            self.bulk_update(
+                [item for item in stats if item.user_id in existing],
+                ['posts_count', 'followers_count', 'following_count'],
+            )
+            self.bulk_create(
+                [item for item in stats if item.user_id not in existing],
+                ignore_conflicts=True,
+            )
+        return stats
+
+    def bump(self, user_id, **deltas):
+        """Меняет счётчики выражениями F(), не опуская их ниже нуля.
+
+        Недостающую строку создаёт пересчётом, но только при росте
+        счётчика у существующего пользователя: уменьшение приходит и из
+        каскадного удаления самого пользователя.
+        """
+        updated = self.filter(user_id=user_id).update(**{
+            field: Greatest(models.F(field) + delta, 0)
+            for field, delta in deltas.items()
+        })
+        if (not updated and any(delta > 0 for delta in deltas.values())
+                and User.objects.filter(pk=user_id).exists()):
+            self.recount([user_id])
+
+    def for_user(self, user):
+        """Статистика пользователя; подхватывает select_related('stats')."""
+        try:
+            return user.stats
+        except AuthorStats.DoesNotExist:
+            return self.recount([user.pk])[0]
+
+
+class AuthorStats(models.Model):
+    """Счётчики профиля, которые поддерживают сигналы постов и подписок."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, db_index=True
+    )
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    # С какого момента посты автора не раскладываются по лентам, см.
+    # feeds.update_celebrity; None — автор не знаменитость
+    celebrity_since = models.DateTimeField(
+        'Знаменитость с', null=True, blank=True, db_index=True
+    )
+    # Когда feed_worker может дописать посты знаменитости в ленты
+    # подписчиков перед выходом из знаменитостей; None — не нужно
+    backfill_after = models.DateTimeField(
+        'Дополнить ленты после', null=True, blank=True, db_index=True
+    )
+
+    objects = AuthorStatsManager()
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self):
+        return str(self.user)
+
+
+class ThumbnailJob(models.Model):
+    """Пост, которому нужно нарезать миниатюры, см. thumbnails."""
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='thumbnail_job'
+    )
+    # Меняется при каждой постановке: обработчик старой задачи не
+    # удалит задачу, поставленную заново после смены картинки
+    queued_at = models.DateTimeField('Поставлена')
+    # Когда задачу можно взять; None — попытки исчерпаны
+    run_after = models.DateTimeField(
+        'Выполнить после', null=True, blank=True, db_index=True
+    )
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+
+    class Meta:
+        verbose_name = 'Задача миниатюр'
+        verbose_name_plural = 'Задачи миниатюр'
+
+    def __str__(self):
+        return f'{self.post_id}: {self.attempts}'
@@ -0,0 +1,181 @@
+"""Отсев несуществующих авторов, групп и постов без запросов к базе.
+
+Боты перебирают /profile/<имя>/, /group/<slug>/ и /posts/<id>/ со
+случайными ключами. Кэш промахов от этого не спасает: каждый ключ новый.
+Фильтр Блума по всем ключам модели отвечает «точно нет» без базы; его
+пересобирает один воркер раз в NEGATIVE_FILTER_REBUILD секунд.
+
+Новый ключ помечается в кэше временем появления. Фильтр помнит, когда
+началась его сборка, и отметка действует, пока фильтр собран до неё:
+старая копия фильтра отдаётся, пока идёт пересборка. Отметка живёт,
+пока в кэше может лежать фильтр без её ключа, то есть два срока
+пересборки; устаревшую отметку раньше удаляет первый запрос, который
+на неё наткнулся. Записи, созданные в обход сигналов (bulk_create,
+SQL), нужно отметить через mark_added самим, иначе до пересборки они
+отдают 404.
+
+Разобранный фильтр хранится в памяти процесса. Из кэша читается только
+время сборки опубликованного фильтра: битовый массив не распаковывается
+на каждом запросе.
+"""
+import math
+import time
+from hashlib import blake2b, md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .caching import record, single_flight
+from .models import Group, Post, User
+
+FILTER_CACHE_KEY = 'posts:negative:filter:{}'
+FILTER_STARTED_KEY = 'posts:negative:filter:{}:started'
+# Версия записи фильтра в кэше; меняется вместе с форматом BloomFilter
+FILTER_VERSION = 2
+FILTER_CACHE = 'key_filter'
+ADDED_KEY = 'posts:negative:added:{}:{}'
+MISSING_KEY = 'posts:negative:missing:{}:{}'
+KEY_SPACES = {
+    'user': (User, 'username'),
+    'group': (Group, 'slug'),
+    'post': (Post, 'pk'),
+}
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray с двойным хэшированием."""
+
+    def __init__(self, size, hashes):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+        # Время начала сборки: ключи, отмеченные позже, могут в фильтр
+        # не попасть.
+        self.started_at = time.time()
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        capacity = max(capacity, 1)
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return cls(size, hashes)
+
+    def _positions(self, value):
+        digest = blake2b(str(value).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return (
+            (first + i * second) % self.size for i in range(self.hashes)
+        )
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+def build_filter(kind):
+    started_at = time.time()
+    model, field = KEY_SPACES[kind]
+    keys = model.objects.values_list(field, flat=True)
+    bloom = BloomFilter.for_capacity(
+        # Запас на ключи, которые появятся до следующей пересборки.
+        int(keys.count() * 1.2) + 1000,
+        settings.NEGATIVE_FILTER_ERROR_RATE,
+    )
+    for key in keys.iterator():
+        bloom.add(key)
+    bloom.started_at = started_at
+    return bloom
+
+
+# Разобранные фильтры процесса: вид ключа -> BloomFilter
+_filters = {}
+
+
+def publish_filter(kind):
+    bloom = build_filter(kind)
+    # Живёт до мягкого срока фильтра: после него key_filter снова
+    # пойдёт через single_flight и запустит пересборку.
+    cache.set(
+        FILTER_STARTED_KEY.format(kind), bloom.started_at,
+        settings.NEGATIVE_FILTER_REBUILD,
+    )
+    return bloom
+
+
+def key_filter(kind):
+    bloom = _filters.get(kind)
+    started_at = cache.get(FILTER_STARTED_KEY.format(kind))
+    if bloom is not None and bloom.started_at == started_at:
+        record(FILTER_CACHE, 'hit')
+        return bloom
+    bloom, _, _ = single_flight(
+        FILTER_CACHE_KEY.format(kind),
+        FILTER_VERSION,
+        lambda: publish_filter(kind),
+        FILTER_CACHE,
+        settings.NEGATIVE_FILTER_REBUILD,
+        settings.NEGATIVE_FILTER_REBUILD * 2,
+    )
+    _filters[kind] = bloom
+    return bloom
+
+
+def value_key(template, kind, value):
+    # Ключи приходят из URL: длина и символы не ограничены.
+    return template.format(kind, md5(str(value).encode()).hexdigest())
+
+
+def may_exist(kind, value):
+    """False, если ключа value точно нет; True — нужно спросить базу."""
+    if cache.get(value_key(MISSING_KEY, kind, value)) is not None:
+        return False
+    bloom = key_filter(kind)
+    if value in bloom:
+        return True
+    added_key = value_key(ADDED_KEY, kind, value)
+    added_at = cache.get(added_key)
+    if added_at is None:
+        return False
+    if added_at >= bloom.started_at:
+        return True
+    # Фильтр собран после отметки, а ключа в нём нет: запись удалена.
+    cache.delete(added_key)
+    return False
+
+
+def mark_missing(kind, value):
+    """Кэширует ненадолго ключ, которого нет в базе, хотя фильтр его
+    пропустил: ложное срабатывание или удалённая запись.
+    """
+    cache.set(
+        value_key(MISSING_KEY, kind, value), True,
+        settings.NEGATIVE_MISS_TIMEOUT,
+    )
+
+
+def mark_added(kind, *values):
+    """Ключи появились в базе: фильтр должен пропускать их до пересборки.
+
+    Отметка ставится сразу и ещё раз после коммита: сборка, начатая до
+    коммита, записи не увидит, и отметка должна быть новее неё.
+    """
+    def mark():
+        now = time.time()
+        cache.set_many({
+            value_key(ADDED_KEY, kind, value): now for value in values
+        }, settings.NEGATIVE_FILTER_REBUILD * 2
+            + settings.CACHE_REBUILD_LOCK_TIMEOUT)
+        cache.delete_many([
+            value_key(MISSING_KEY, kind, value) for value in values
+        ])
+
+    mark()
+    transaction.on_commit(mark)
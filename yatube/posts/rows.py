@@ -0,0 +1,120 @@
+"""Компактные строки лент для кэша страниц.
+
+Экземпляр Post с выбранными автором и группой тащит в pickle состояние
+модели, _state и все поля User, включая хэш пароля. В кэше страницы
+лежат только поля, которые выводят карточки, в виде кортежей.
+"""
+from .models import Post
+
+
+class AuthorRow:
+    __slots__ = ('pk', 'username', 'first_name', 'last_name')
+
+    def __init__(self, pk, username, first_name, last_name):
+        self.pk = pk
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+
+    def __reduce__(self):
+        return AuthorRow, (
+            self.pk, self.username, self.first_name, self.last_name
+        )
+
+    def __str__(self):
+        return self.username
+
+    def get_full_name(self):
+        return f'{self.first_name} {self.last_name}'.strip()
+
+
+class GroupRow:
+    __slots__ = ('pk', 'slug', 'title')
+
+    def __init__(self, pk, slug, title):
+        self.pk = pk
+        self.slug = slug
+        self.title = title
+
+    def __reduce__(self):
+        return GroupRow, (self.pk, self.slug, self.title)
+
+    def __str__(self):
+        return self.title
+
+
+class FeedRow:
+    """Пост ленты в том виде, в каком его выводят карточки.
+
+    Строка равна посту с тем же pk, поэтому код, сравнивающий записи
+    страницы с моделями, работает и с ней. is_liked зависит от зрителя
+    и в кэш не попадает.
+    """
+
+    __slots__ = (
+        'pk', 'text', 'pub_date', 'updated_at', 'image', 'thumbnails',
+        'like_count', 'author', 'group', 'is_liked',
+    )
+
+    def __init__(self, pk, text, pub_date, updated_at, image, thumbnails,
+                 like_count, author, group=None):
+        self.pk = pk
+        self.text = text
+        self.pub_date = pub_date
+        self.updated_at = updated_at
+        self.image = image
+        self.thumbnails = thumbnails
+        self.like_count = like_count
+        self.author = author
+        self.group = group
+        self.is_liked = False
+
+    @classmethod
+    def from_post(cls, post):
+        """Строка из поста с выбранными через select_related автором и
+        группой.
+        """
+        author, group = post.author, post.group
+        return cls(
+            post.pk,
+            post.text,
+            post.pub_date,
+            post.updated_at,
+            post.image.name or '',
+            post.thumbnails,
+            post.like_count,
+            AuthorRow(
+                author.pk, author.username, author.first_name,
+                author.last_name,
+            ),
+            group and GroupRow(group.pk, group.slug, group.title),
+        )
+
+    def __reduce__(self):
+        return FeedRow, (
+            self.pk, self.text, self.pub_date, self.updated_at, self.image,
+            self.thumbnails, self.like_count, self.author, self.group,
+        )
+
+    @property
+    def id(self):
+        return self.pk
+
+    @property
+    def author_id(self):
+        return self.author.pk
+
+    @property
+    def group_id(self):
+        return self.group and self.group.pk
+
+    def __eq__(self, other):
+        if isinstance(other, (FeedRow, Post)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __repr__(self):
+        return f'<FeedRow: {self.pk}>'
@@ -0,0 +1,159 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import feeds, identity, negative
+from .caching import bump_feed_versions
+from .models import (AuthorStats, Comment, Follow, Group, Likes, Post, User,
+                     like_toggled)
+from .units import invalidate_feeds
+
+# Поля автора и группы, которые видны в карточке поста
+CARD_FIELDS = {
+    User: ('username', 'first_name', 'last_name'),
+    Group: ('title', 'slug'),
+}
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, raw=False, **kwargs):
+    instance._saved_group_id = None
+    if instance.pk and not raw:
+        instance._saved_group_id = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    keys = feeds.feed_keys(instance, [instance._saved_group_id])
+    bump_feed_versions([f'post:{instance.pk}'])
+    if created:
+        negative.mark_added('post', instance.pk)
+        AuthorStats.objects.bump(instance.author_id, posts_count=1)
+        feeds.fan_out_post(instance)
+    invalidate_feeds(keys)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    AuthorStats.objects.bump(instance.author_id, posts_count=-1)
+    invalidate_feeds(feeds.feed_keys(instance))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.bump(instance.author_id, followers_count=1)
+        AuthorStats.objects.bump(instance.user_id, following_count=1)
+        feeds.update_celebrity(instance.author_id)
+        feeds.backfill_timeline(instance.user_id, instance.author_id)
+        invalidate_feeds([f'follow:{instance.user_id}'])
+        # Профиль автора показывает число подписчиков и кнопку подписки,
+        # профиль подписчика — число подписок.
+        bump_feed_versions([
+            f'profile:{instance.author_id}', f'profile:{instance.user_id}'
+        ])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    AuthorStats.objects.bump(instance.author_id, followers_count=-1)
+    AuthorStats.objects.bump(instance.user_id, following_count=-1)
+    feeds.update_celebrity(instance.author_id)
+    feeds.drop_from_timeline(instance.user_id, instance.author_id)
+    invalidate_feeds([f'follow:{instance.user_id}'])
+    bump_feed_versions([
+        f'profile:{instance.author_id}', f'profile:{instance.user_id}'
+    ])
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.post_id is not None:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1
+        )
+        bump_feed_versions([f'post:{instance.post_id}'])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=Greatest(F('comment_count') - 1, 0)
+        )
+        bump_feed_versions([f'post:{instance.post_id}'])
+
+
+@receiver(like_toggled, sender=Likes)
+def like_changed(sender, post_id, **kwargs):
+    # Число лайков показывается в карточках: страницы лент устаревают,
+    # а число записей в них остаётся прежним.
+    post = Post.objects.filter(pk=post_id).only('author', 'group').first()
+    if post is not None:
+        bump_feed_versions(feeds.feed_keys(post))
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Group)
+def identity_changing(sender, instance, raw=False, update_fields=None,
+                      **kwargs):
+    field = identity.IDENTITY_FIELDS[sender][0]
+    shown = CARD_FIELDS[sender]
+    instance._saved_identity = None
+    instance._saved_card = None
+    if (not instance.pk or raw or (
+            update_fields is not None and not set(update_fields) & set(shown)
+    )):
+        return
+    row = sender.objects.filter(pk=instance.pk).values_list(*shown).first()
+    if row is None:
+        return
+    instance._saved_card = row
+    if update_fields is None or field in update_fields:
+        instance._saved_identity = row[shown.index(field)]
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Group)
+def identity_saved(sender, instance, created=False, raw=False, **kwargs):
+    # Сохранение без изменения имени, например last_login при входе,
+    # всё равно сбрасывает кэш: там лежат имя и фамилия.
+    field = identity.IDENTITY_FIELDS[sender][0]
+    value = getattr(instance, field)
+    saved = getattr(instance, '_saved_identity', None)
+    identity.forget(sender, [value, saved])
+    if created or (saved is not None and value != saved):
+        negative.mark_added(sender._meta.model_name, value)
+    saved_card = getattr(instance, '_saved_card', None)
+    shown = tuple(getattr(instance, name) for name in CARD_FIELDS[sender])
+    if saved_card is not None and shown != saved_card:
+        related = 'author' if sender is User else 'group'
+        feeds.refresh_cards(Post.objects.filter(**{related: instance}))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # Посты группы остаются с group=NULL простым UPDATE, без сигналов.
+    instance._post_ids = list(
+        instance.posts.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    feeds.refresh_cards(
+        Post.objects.filter(pk__in=getattr(instance, '_post_ids', ())),
+        keys=[f'group:{instance.pk}'],
+    )
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+def identity_deleted(sender, instance, **kwargs):
+    field = identity.IDENTITY_FIELDS[sender][0]
+    identity.forget(sender, [getattr(instance, field)])
@@ -0,0 +1,109 @@
+import re
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.defaulttags import CsrfTokenNode
+from django.template.loader import get_template
+from django.templatetags.static import static
+from django.utils.safestring import mark_safe
+
+from ..caching import record
+
+register = template.Library()
+
+FRAGMENT_CACHE_KEY = 'posts:fragment:{}'
+FRAGMENT_CACHE = 'feed_fragment'
+CARD_CACHE_KEY = 'posts:card:{}:{}:{}'
+CARD_CACHE = 'post_card'
+CARD_TEMPLATES = {
+    'full': 'includes/card.html',
+    'compact': 'includes/card_compact.html',
+}
+# Пока рендерится общий фрагмент, личные теги выводят метки-дырки.
+SHARED = 'shared_fragment'
+CSRF_HOLE = '<!--hole:csrf-->'
+LIKE_ICON_HOLE = '<!--hole:like-icon:{}-->'
+LIKE_ICON_HOLES = re.compile(r'<!--hole:like-icon:(\d+)-->')
+
+
+def like_icon_url(liked):
+    return static('img/unlike.png' if liked else 'img/like.png')
+
+
+def fill_holes(html, context, page):
+    """Подставляет в общий фрагмент данные текущего зрителя."""
+    liked = {post.pk for post in page if getattr(post, 'is_liked', False)}
+    html = html.replace(CSRF_HOLE, CsrfTokenNode().render(context))
+    return LIKE_ICON_HOLES.sub(
+        lambda match: like_icon_url(int(match.group(1)) in liked), html
+    )
+
+
+class FeedFragmentNode(template.Node):
+    def __init__(self, nodelist, page):
+        self.nodelist = nodelist
+        self.page = page
+
+    def render(self, context):
+        page = self.page.resolve(context)
+        key = getattr(page, 'fragment_key', None)
+        if key is None:
+            return self.nodelist.render(context)
+        cache_key = FRAGMENT_CACHE_KEY.format(key)
+        html = cache.get(cache_key)
+        record(FRAGMENT_CACHE, 'miss' if html is None else 'hit')
+        if html is None:
+            with context.push({SHARED: True}):
+                html = self.nodelist.render(context)
+            cache.set(cache_key, html, settings.FEED_PAGE_CACHE_TIMEOUT)
+        return mark_safe(fill_holes(html, context, page))
+
+
+@register.tag
+def feed_fragment(parser, token):
+    """Кэширует общий для всех зрителей HTML страницы ленты.
+
+    {% feed_fragment page_obj %}...{% endfeed_fragment %}: ключ берётся
+    из версии ленты страницы, личные части внутри оставляются дырками.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает один аргумент: страницу ленты'
+        )
+    nodelist = parser.parse(('endfeed_fragment',))
+    parser.delete_first_token()
+    return FeedFragmentNode(nodelist, parser.compile_filter(bits[1]))
+
+
+@register.simple_tag(takes_context=True)
+def csrf_hole(context):
+    if context.get(SHARED):
+        return mark_safe(CSRF_HOLE)
+    return CsrfTokenNode().render(context)
+
+
+@register.simple_tag(takes_context=True)
+def like_icon(context, post):
+    if context.get(SHARED):
+        return mark_safe(LIKE_ICON_HOLE.format(post.pk))
+    return like_icon_url(getattr(post, 'is_liked', False))
+
+
+@register.simple_tag
+def post_card(post, variant='full'):
+    """Карточка поста, общая для всех лент и всех зрителей.
+
+    Ключ включает updated_at: правка поста через post_edit меняет
+    ключ, и старая карточка больше не читается.
+    """
+    cache_key = CARD_CACHE_KEY.format(
+        variant, post.pk, post.updated_at.timestamp()
+    )
+    html = cache.get(cache_key)
+    record(CARD_CACHE, 'miss' if html is None else 'hit')
+    if html is None:
+        html = get_template(CARD_TEMPLATES[variant]).render({'post': post})
+        cache.set(cache_key, html, settings.POST_CARD_CACHE_TIMEOUT)
+    return mark_safe(html)
@@ -0,0 +1,13 @@
+from django import template
+
+from ..thumbnails import thumbnail_for
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(post, alias):
+    """{% post_thumbnail post 'card' as im %}: адрес и размеры готовой
+    миниатюры без обращения к картинке и KV-хранилищу sorl.
+    """
+    return thumbnail_for(post, alias)
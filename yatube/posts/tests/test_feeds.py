@@ -0,0 +1,201 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..caching import feed_version
+from ..feeds import HybridFeed
+from ..models import AuthorStats, Follow, Post, Timeline
+
+User = get_user_model()
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def timeline_posts(self):
+        return list(Timeline.objects.filter(
+            user=self.reader).values_list('post_id', flat=True))
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков автора"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        Post.objects.create(author=self.other, text='Чужой пост')
+        self.assertEqual(self.timeline_posts(), [post.pk])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        """Подписка добавляет старые посты автора, отписка убирает их"""
+        post = Post.objects.create(author=self.author, text='Старый пост')
+        self.reader_client.get(
+            reverse('posts:profile_follow', args=[self.author.username]))
+        self.assertEqual(self.timeline_posts(), [post.pk])
+        self.reader_client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username]))
+        self.assertEqual(self.timeline_posts(), [])
+
+    def test_publish_leaves_follower_versions_alone(self):
+        """Публикация не меняет версии лент подписчиков, а число постов
+        ленты подписок всё равно обновляется
+        """
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(author=self.author, text='Первый')
+        url = reverse('posts:follow_index')
+        response = self.reader_client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        version = feed_version(f'follow:{self.reader.pk}')
+        Post.objects.create(author=self.author, text='Второй')
+        self.assertEqual(feed_version(f'follow:{self.reader.pk}'), version)
+        response = self.reader_client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3)
+    def test_timeline_is_capped(self):
+        """Лента подписок не растёт больше TIMELINE_MAX_ENTRIES"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+            for i in range(5)
+        ]
+        self.assertEqual(
+            self.timeline_posts(), [post.pk for post in posts[:1:-1]]
+        )
+
+    def test_fan_out_trims_timelines_in_one_batch(self):
+        """Число запросов раскладки не зависит от числа подписчиков"""
+        Follow.objects.create(user=self.reader, author=self.author)
+
+        def publish():
+            with CaptureQueriesContext(connection) as queries:
+                Post.objects.create(author=self.author, text='Пост')
+            return len(queries.captured_queries)
+
+        publish()
+        single = publish()
+        for i in range(5):
+            Follow.objects.create(
+                user=User.objects.create_user(username=f'follower{i}'),
+                author=self.author,
+            )
+        self.assertEqual(publish(), single)
+
+    def test_follow_index_reads_timeline(self):
+        """Лента /follow/ строится из материализованной ленты"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Пост в ленте')
+        Timeline.objects.filter(user=self.reader).delete()
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+        call_command(
+            'rebuild_timelines', self.reader.username, stdout=StringIO())
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [post])
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWERS=2)
+class HybridFeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.fan = User.objects.create_user(username='fan')
+        cls.star = User.objects.create_user(username='star')
+        cls.author = User.objects.create_user(username='author')
+
+    def setUp(self):
+        cache.clear()
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.fan, author=self.star)
+        Follow.objects.create(user=self.reader, author=self.author)
+        cache.clear()
+
+    def test_celebrity_posts_are_pulled(self):
+        """Посты знаменитости не раскладываются, а читаются при открытии"""
+        star_post = Post.objects.create(author=self.star, text='Звезда')
+        author_post = Post.objects.create(author=self.author, text='Автор')
+        self.assertFalse(Timeline.objects.filter(post=star_post).exists())
+        self.assertEqual(
+            HybridFeed(self.reader).window(), [author_post, star_post]
+        )
+
+    def test_streams_are_merged_by_date(self):
+        """Потоки сливаются по дате без дублей и постранично"""
+        posts = [
+            Post.objects.create(
+                author=(self.star, self.author)[i % 2], text=f'Пост {i}')
+            for i in range(6)
+        ]
+        # Пост, разложенный до того, как автор стал знаменитостью.
+        Timeline.objects.create(
+            user=self.reader, post=posts[4], pub_date=posts[4].pub_date)
+        feed = HybridFeed(self.reader)
+        self.assertEqual(feed.window(limit=3), posts[:2:-1])
+        self.assertEqual(feed.window(offset=3, limit=3), posts[2::-1])
+        key = (posts[3].pub_date, posts[3].pk)
+        self.assertEqual(feed.window(after=key), posts[2::-1])
+        self.assertEqual(feed.window(before=key), posts[4:])
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWERS=2)
+class CelebrityTransitionTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.star = User.objects.create_user(username='star')
+        self.readers = [
+            User.objects.create_user(username=f'reader{i}') for i in range(2)
+        ]
+        for reader in self.readers:
+            Follow.objects.create(user=reader, author=self.star)
+
+    def test_posts_survive_leaving_celebrities(self):
+        """Посты знаменитости остаются в лентах, когда подписчиков
+        становится меньше порога: отписка ставит автора в очередь, а
+        feed_worker дописывает посты и выводит его из знаменитостей
+        """
+        self.assertIsNotNone(
+            AuthorStats.objects.get(user=self.star).celebrity_since)
+        post = Post.objects.create(author=self.star, text='Звезда')
+        self.assertFalse(Timeline.objects.filter(post=post).exists())
+        reader, leaving = self.readers
+        self.assertEqual(HybridFeed(reader).window(), [post])
+        Follow.objects.filter(user=leaving).delete()
+        stats = AuthorStats.objects.get(user=self.star)
+        self.assertIsNotNone(stats.celebrity_since)
+        self.assertIsNotNone(stats.backfill_after)
+        self.assertFalse(Timeline.objects.filter(post=post).exists())
+        self.assertEqual(HybridFeed(reader).window(), [post])
+        call_command('feed_worker', once=True, stdout=StringIO())
+        stats.refresh_from_db()
+        self.assertIsNone(stats.celebrity_since)
+        self.assertIsNone(stats.backfill_after)
+        self.assertTrue(
+            Timeline.objects.filter(user=reader, post=post).exists())
+        self.assertEqual(HybridFeed(reader).window(), [post])
+
+    def test_returning_followers_keep_celebrity(self):
+        """Если подписчики вернулись до дополнения лент, автор остаётся
+        знаменитостью
+        """
+        reader, leaving = self.readers
+        Follow.objects.filter(user=leaving).delete()
+        Follow.objects.create(user=leaving, author=self.star)
+        call_command('feed_worker', once=True, stdout=StringIO())
+        stats = AuthorStats.objects.get(user=self.star)
+        self.assertIsNotNone(stats.celebrity_since)
+        self.assertIsNone(stats.backfill_after)
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..identity import lookup
+from ..models import Group
+
+User = get_user_model()
+
+
+class IdentityCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='known', password='secret', first_name='Имя')
+        cls.group = Group.objects.create(
+            title='Группа', slug='known-group', description='Описание')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lookup_is_cached(self):
+        """Повторный поиск по имени не обращается к базе"""
+        self.assertEqual(lookup(User, 'known'), self.user)
+        self.assertEqual(lookup(Group, 'known-group'), self.group)
+        with self.assertNumQueries(0):
+            user = lookup(User, 'known')
+            group = lookup(Group, 'known-group')
+        self.assertEqual(user.get_full_name(), 'Имя')
+        self.assertEqual(group.title, 'Группа')
+        self.assertNotIn('password', user.__dict__)
+
+    def test_rename_invalidates_both_names(self):
+        """Переименование сбрасывает кэш старого и нового имени"""
+        lookup(User, 'known')
+        lookup(User, 'renamed')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertIsNone(lookup(User, 'known'))
+        self.assertEqual(lookup(User, 'renamed'), self.user)
+
+    def test_missing_name_is_cached_until_created(self):
+        """Отсутствующее имя кэшируется, пока объект не создан"""
+        self.assertIsNone(lookup(Group, 'new'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(lookup(Group, 'new'))
+        group = Group.objects.create(title='Новая', slug='new')
+        self.assertEqual(lookup(Group, 'new'), group)
+        group.delete()
+        self.assertIsNone(lookup(Group, 'new'))
+
+    def test_unknown_profile_is_not_found(self):
+        """Профиль неизвестного автора отдаёт 404"""
+        client = Client()
+        for _ in range(2):
+            response = client.get(
+                reverse('posts:profile', args=['unknown']))
+            self.assertEqual(response.status_code, 404)
@@ -0,0 +1,115 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test import override_settings
+from django.urls import reverse
+
+from ..caching import (REBUILD_LOCK_KEY, bump_feed_versions, cache_stats,
+                       flush_cache_stats, single_flight)
+from ..models import Post
+
+User = get_user_model()
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        flush_cache_stats()
+        cache.clear()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return self.builds
+
+    def get(self, version, soft_timeout=60):
+        return single_flight(
+            'test:key', version, self.build, 'test', soft_timeout, 60)
+
+    def test_fresh_value_is_built_once(self):
+        """Свежее значение собирается один раз"""
+        self.assertEqual(self.get(1), (1, 1, False))
+        self.assertEqual(self.get(1), (1, 1, False))
+        self.assertEqual(cache_stats(['test'])['test'], (1, 1, 0))
+
+    def test_stale_value_while_other_worker_rebuilds(self):
+        """Пока другой воркер пересобирает значение, отдаётся старое"""
+        self.get(1)
+        cache.add(REBUILD_LOCK_KEY.format('test:key'), True)
+        self.assertEqual(self.get(2), (1, 1, True))
+        self.assertEqual(self.builds, 1)
+        cache.delete(REBUILD_LOCK_KEY.format('test:key'))
+        self.assertEqual(self.get(2), (2, 2, False))
+
+    def test_soft_timeout_triggers_rebuild(self):
+        """После мягкого срока значение пересобирается"""
+        self.get(1, soft_timeout=0)
+        self.assertEqual(self.get(1), (2, 1, False))
+
+    @override_settings(CACHE_REBUILD_WAIT=0.05)
+    def test_no_copy_waits_for_builder(self):
+        """Без старой копии запрос ждёт сборщика, а потом считает сам"""
+        cache.add(REBUILD_LOCK_KEY.format('test:key'), True)
+        self.assertEqual(self.get(1), (1, 1, False))
+        self.assertIsNone(cache.get('test:key'))
+
+
+class FeedStampedeTests(TransactionTestCase):
+    """Нагрузочный тест: запросы ленты во время всплесков инвалидаций."""
+
+    threads = 8
+    rounds = 10
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='load')
+        Post.objects.bulk_create(
+            Post(author=user, text=f'Пост {i}') for i in range(30))
+
+    def reader(self, barrier, queries, errors):
+        client = Client()
+        url = reverse('posts:index')
+
+        def count(execute, sql, params, many, context):
+            if 'FROM "posts_post"' in sql:
+                queries.append(sql)
+            return execute(sql, params, many, context)
+
+        try:
+            with connection.execute_wrapper(count):
+                for _ in range(self.rounds):
+                    barrier.wait()
+                    if client.get(url).status_code != 200:
+                        errors.append('status')
+                    barrier.wait()
+        except Exception as error:
+            errors.append(error)
+            barrier.abort()
+        finally:
+            connection.close()
+
+    def test_query_rate_is_flat_during_invalidations(self):
+        """Во время всплеска инвалидаций ленту пересобирает один воркер"""
+        self.client.get(reverse('posts:index'))
+        barrier = threading.Barrier(self.threads + 1)
+        queries, errors = [], []
+        workers = [
+            threading.Thread(target=self.reader,
+                             args=(barrier, queries, errors))
+            for _ in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for _ in range(self.rounds):
+            for _ in range(5):
+                bump_feed_versions(['index'])
+            barrier.wait()
+            barrier.wait()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        # Без single flight каждый из запросов пересобирал бы страницу:
+        # threads * rounds запросов к posts_post.
+        self.assertLessEqual(len(queries), self.rounds * 2)
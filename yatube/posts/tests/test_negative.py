@@ -0,0 +1,117 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Group, Post
+from ..negative import (ADDED_KEY, FILTER_CACHE_KEY, FILTER_STARTED_KEY,
+                        FILTER_VERSION, BloomFilter, build_filter,
+                        key_filter, value_key)
+
+User = get_user_model()
+
+
+class BloomFilterTests(TestCase):
+    def test_no_false_negatives(self):
+        """Фильтр пропускает все добавленные ключи и отсекает почти все
+        остальные
+        """
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'user{i}')
+        self.assertTrue(all(f'user{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'bot{i}' in bloom for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+
+class NegativeLookupTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='existing')
+        cls.group = Group.objects.create(
+            title='Группа', slug='existing', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Пост', group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        for kind in ('user', 'group', 'post'):
+            key_filter(kind)
+
+    def test_unknown_keys_skip_database(self):
+        """Несуществующие профиль, группа и пост отдают 404 без базы"""
+        urls = [
+            reverse('posts:profile', args=['bot-probe']),
+            reverse('posts:postsname', args=['bot-probe']),
+            reverse('posts:post_detail', args=[self.post.pk + 1000]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+
+    def test_keys_added_after_build_are_found(self):
+        """Новые автор и пост доступны до пересборки фильтра"""
+        user = User.objects.create_user(username='newcomer')
+        post = Post.objects.create(author=user, text='Новый', group=self.group)
+        client = Client()
+        self.assertEqual(client.get(
+            reverse('posts:profile', args=[user.username])).status_code, 200)
+        self.assertEqual(client.get(
+            reverse('posts:post_detail', args=[post.pk])).status_code, 200)
+
+    def test_deleted_post_is_cached_as_missing(self):
+        """Удалённый пост остаётся в фильтре, но промах кэшируется"""
+        post = Post.objects.create(author=self.user, text='Удалим')
+        url = reverse('posts:post_detail', args=[post.pk])
+        post.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_filter_built_before_key_keeps_mark(self):
+        """Фильтр, сборка которого началась до появления ключа, не прячет
+        его, даже если опубликован позже
+        """
+        bloom = build_filter('user')
+        user = User.objects.create_user(username='latecomer')
+        cache.set(FILTER_CACHE_KEY.format('user'),
+                  (FILTER_VERSION, float('inf'), bloom), None)
+        cache.set(FILTER_STARTED_KEY.format('user'), bloom.started_at, None)
+        self.assertEqual(self.client.get(
+            reverse('posts:profile', args=[user.username])).status_code, 200)
+
+    def test_mark_older_than_filter_is_dropped(self):
+        """Отметку удалённого ключа удаляет запрос к новому фильтру"""
+        post = Post.objects.create(author=self.user, text='Удалим')
+        url = reverse('posts:post_detail', args=[post.pk])
+        added_key = value_key(ADDED_KEY, 'post', post.pk)
+        post.delete()
+        cache.delete_many([
+            FILTER_CACHE_KEY.format('post'), FILTER_STARTED_KEY.format('post')
+        ])
+        key_filter('post')
+        self.assertIsNotNone(cache.get(added_key))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertIsNone(cache.get(added_key))
+
+    def test_filter_is_kept_in_process(self):
+        """Фильтр не распаковывается из кэша заново на каждом запросе"""
+        self.assertIs(key_filter('user'), key_filter('user'))
+
+    def test_login_does_not_mark_user(self):
+        """Сохранение пользователя без смены имени не ставит отметку"""
+        user = User.objects.create_user(username='returning')
+        added_key = value_key(ADDED_KEY, 'user', user.username)
+        cache.delete(added_key)
+        user.save(update_fields=['last_login'])
+        user.first_name = 'Имя'
+        user.save()
+        self.assertIsNone(cache.get(added_key))
+        user.username = 'renamed'
+        user.save()
+        self.assertIsNotNone(
+            cache.get(value_key(ADDED_KEY, 'user', 'renamed')))
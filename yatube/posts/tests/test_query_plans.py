@@ -0,0 +1,85 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Follow, Group, Likes, Post
+
+User = get_user_model()
+
+FULL_SCAN = re.compile(
+    r'^SCAN (TABLE )?(posts_post|posts_timeline|posts_follow|posts_likes)\b'
+)
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWERS=2)
+class FeedQueryPlanTests(TestCase):
+    """Запросы лент идут по индексам, без полного просмотра и сортировки."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.fan = User.objects.create_user(username='fan')
+        cls.star = User.objects.create_user(username='star')
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='plans', description='Описание')
+        Follow.objects.create(user=cls.reader, author=cls.star)
+        Follow.objects.create(user=cls.fan, author=cls.star)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(12):
+            post = Post.objects.create(
+                author=(cls.star, cls.author)[i % 2],
+                group=cls.group if i % 3 else None,
+                text=f'Пост {i}',
+            )
+            Likes.toggle(cls.reader, post.pk)
+        cls.reader_client = Client()
+        cls.reader_client.force_login(cls.reader)
+
+    def setUp(self):
+        cache.clear()
+
+    def feed_urls(self):
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:postsname', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:follow_index'),
+        ]
+        return urls + [f'{url}?page=2' for url in urls]
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_feed_queries_use_indexes(self):
+        """Каждый запрос ленты использует индекс и не сортирует во временном
+        B-дереве.
+        """
+        for url in self.feed_urls():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.reader_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            next_cursor = response.context['page_obj'].next_cursor
+            if next_cursor:
+                with CaptureQueriesContext(connection) as cursor_queries:
+                    self.reader_client.get(url, {'cursor': next_cursor})
+                queries.captured_queries.extend(
+                    cursor_queries.captured_queries)
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT'):
+                    continue
+                for detail in self.query_plan(sql):
+                    with self.subTest(url=url, sql=sql, plan=detail):
+                        self.assertNotIn('USE TEMP B-TREE', detail)
+                        self.assertFalse(
+                            FULL_SCAN.match(detail) and 'INDEX' not in detail
+                        )
@@ -0,0 +1,279 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from sorl.thumbnail import get_thumbnail
+
+from ..models import Post, ThumbnailJob
+from ..thumbnails import (attach_thumbnails, generate_thumbnails,
+                          queue_thumbnails, thumbnail_for)
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def uploaded(name='small.gif'):
+    return SimpleUploadedFile(
+        name=name, content=SMALL_GIF, content_type='image/gif')
+
+
+def photo(name='photo.jpg', size=(1600, 600)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'teal').save(buffer, 'JPEG')
+    return SimpleUploadedFile(
+        name=name, content=buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+        cls.client_user = Client()
+        cls.client_user.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_generate_thumbnails_stores_metadata(self):
+        """Миниатюры записываются в пост вместе с размерами"""
+        post = Post.objects.create(
+            author=self.user, text='Пост', image=uploaded())
+        self.client_user.get(reverse('posts:index'))
+        generate_thumbnails(post.pk)
+        post.refresh_from_db()
+        card = post.thumbnails['card']
+        self.assertEqual((card['width'], card['height']), (960, 339))
+        response = self.client_user.get(reverse('posts:index'))
+        self.assertContains(response, card['url'])
+
+    def test_responsive_variants(self):
+        """Миниатюра режется в нескольких ширинах WebP и JPEG, карточка
+        выводит srcset, ленивую загрузку и заглушку
+        """
+        post = Post.objects.create(
+            author=self.user, text='Пост', image=photo())
+        generate_thumbnails(post.pk)
+        post.refresh_from_db()
+        card = post.thumbnails['card']
+        for format, extension in (('webp', '.webp'), ('jpeg', '.jpg')):
+            with self.subTest(format=format):
+                self.assertEqual(
+                    [width for _, width, _ in card['sources'][format]],
+                    [480, 960, 1440],
+                )
+                self.assertTrue(
+                    card['sources'][format][0][0].endswith(extension))
+        self.assertTrue(card['lqip'].startswith('data:image/jpeg;base64,'))
+        response = self.client_user.get(reverse('posts:index'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f'{card["sources"]["jpeg"][0][0]} 480w')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, card['lqip'])
+
+    def test_small_image_is_not_upscaled_for_srcset(self):
+        """Ширины больше исходника не увеличиваются и выводятся один раз"""
+        post = Post.objects.create(
+            author=self.user, text='Пост', image=photo(size=(600, 300)))
+        generate_thumbnails(post.pk)
+        post.refresh_from_db()
+        im = thumbnail_for(post, 'card')
+        self.assertEqual(im['srcset']['webp'].count(' 600w'), 1)
+        self.assertNotIn('1440w', im['srcset']['webp'])
+
+    def test_variants_keep_card_aspect_ratio(self):
+        """Все варианты srcset вырезаны в пропорциях карточки"""
+        for size in ((600, 300), (1200, 900), (1600, 600), (500, 120)):
+            post = Post.objects.create(
+                author=self.user, text='Пост', image=photo(size=size))
+            generate_thumbnails(post.pk)
+            post.refresh_from_db()
+            card = post.thumbnails['card']
+            for format, sources in card['sources'].items():
+                for url, width, height in sources:
+                    with self.subTest(size=size, format=format, width=width):
+                        self.assertAlmostEqual(
+                            height, width * 339 / 960, delta=1)
+
+    def test_feed_renders_without_image_processing(self):
+        """Лента с готовыми миниатюрами не обращается к sorl"""
+        post = Post.objects.create(
+            author=self.user, text='Пост', image=uploaded())
+        generate_thumbnails(post.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.client_user.get(reverse('posts:index'))
+        self.assertFalse(any(
+            'thumbnail_kvstore' in query['sql']
+            for query in queries.captured_queries
+        ))
+
+    def test_pending_thumbnail_shows_original(self):
+        """Пока миниатюр нет, в карточке выводится оригинал"""
+        post = Post.objects.create(
+            author=self.user, text='Пост', image=uploaded())
+        response = self.client_user.get(reverse('posts:index'))
+        self.assertContains(response, f'src="{post.image.url}"')
+
+    def test_legacy_thumbnails_are_read_in_one_batch(self):
+        """Миниатюры старых постов читаются одним запросом на страницу"""
+        posts = [
+            Post.objects.create(
+                author=self.user, text=f'Пост {i}', image=uploaded())
+            for i in range(3)
+        ]
+        urls = {
+            post.pk: get_thumbnail(
+                post.image, '960x339', crop='center', upscale=True).url
+            for post in posts
+        }
+        cache.clear()
+        posts = list(Post.objects.filter(pk__in=urls))
+        with CaptureQueriesContext(connection) as queries:
+            attach_thumbnails(posts)
+        self.assertEqual(len(queries.captured_queries), 1)
+        for post in posts:
+            self.assertEqual(post.thumbnails['card']['url'], urls[post.pk])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RegenerateThumbnailsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='archive')
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user, text=f'Пост {i}', image=uploaded())
+            for i in range(3)
+        ]
+        Post.objects.create(author=cls.user, text='Без картинки')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'checkpoint')
+
+    def regenerate(self, **options):
+        out = StringIO()
+        call_command(
+            'regenerate_thumbnails', processes=1, chunk_size=2,
+            checkpoint=self.checkpoint, stdout=out, **options)
+        return out.getvalue()
+
+    def test_regenerates_and_skips_up_to_date(self):
+        """Команда режет недостающие миниатюры и пропускает готовые"""
+        self.assertIn('нарезано 3, пропущено 0', self.regenerate())
+        self.assertTrue(all(
+            post.thumbnails.get('card')
+            for post in Post.objects.exclude(image='')
+        ))
+        self.assertIn('нарезано 0, пропущено 3', self.regenerate())
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_geometry_change_makes_thumbnails_stale(self):
+        """После смены размера миниатюры режутся заново"""
+        self.regenerate()
+        with override_settings(POST_THUMBNAILS={
+                'card': ('480x170', {'crop': 'center', 'upscale': True})}):
+            self.assertIn('нарезано 3', self.regenerate())
+        card = Post.objects.get(pk=self.posts[0].pk).thumbnails['card']
+        self.assertEqual((card['width'], card['height']), (480, 170))
+
+    def test_resumes_after_checkpoint(self):
+        """Прерванный запуск продолжается после контрольной точки"""
+        with open(self.checkpoint, 'w') as checkpoint:
+            checkpoint.write(str(self.posts[1].pk))
+        out = self.regenerate()
+        self.assertIn(f'Продолжаем после поста {self.posts[1].pk}', out)
+        self.assertIn('нарезано 1, пропущено 0', out)
+        self.assertEqual(
+            Post.objects.get(pk=self.posts[0].pk).thumbnails, {})
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailJobsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def work(self):
+        out = StringIO()
+        call_command('thumbnail_worker', once=True, stdout=out)
+        return out.getvalue()
+
+    def test_post_create_queues_job_for_worker(self):
+        """Создание поста ставит задачу, миниатюры режет воркер"""
+        self.client.post(reverse('posts:post_create'), {
+            'text': 'С картинкой', 'image': uploaded('queued.gif'),
+        })
+        post = Post.objects.get(text='С картинкой')
+        self.assertEqual(post.thumbnails, {})
+        self.assertTrue(ThumbnailJob.objects.filter(post=post).exists())
+        self.assertIn('нарезано 1, ошибок 0', self.work())
+        post.refresh_from_db()
+        self.assertIn('card', post.thumbnails)
+        self.assertFalse(ThumbnailJob.objects.filter(post=post).exists())
+
+    @override_settings(THUMBNAIL_JOB_MAX_ATTEMPTS=2)
+    def test_failed_job_is_retried_then_parked(self):
+        """Упавшая задача откладывается на повтор, а после последней
+        попытки ждёт regenerate_thumbnails
+        """
+        post = Post.objects.create(
+            author=self.user, text='Пост', image=uploaded('broken.gif'))
+        queue_thumbnails(post)
+        os.remove(post.image.path)
+        with self.assertLogs('posts.thumbnails', 'ERROR'):
+            self.assertIn('ошибок 1', self.work())
+        job = ThumbnailJob.objects.get(post=post)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertTrue(job.last_error)
+        self.assertIn('нарезано 0, ошибок 0', self.work())
+        ThumbnailJob.objects.filter(pk=job.pk).update(
+            run_after=timezone.now())
+        with self.assertLogs('posts.thumbnails', 'ERROR'):
+            self.work()
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(job.run_after)
@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from ..forms import PostForm
+from ..models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def photo(size, format='JPEG', orientation=None, name='photo.jpg'):
+    buffer = BytesIO()
+    options = {}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = 'Phone'
+        options['exif'] = exif.tobytes()
+    Image.new('RGB', size, 'orange').save(buffer, format, **options)
+    return SimpleUploadedFile(name=name, content=buffer.getvalue())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POST_IMAGE_MAX_SIDE=64)
+class ImageIngestionTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def clean(self, upload):
+        form = PostForm(data={'text': 'Пост'}, files={'image': upload})
+        form.is_valid()
+        return form
+
+    def test_large_photo_is_shrunk_and_exif_removed(self):
+        """Большое фото уменьшается, поворачивается по EXIF и теряет EXIF"""
+        form = self.clean(photo((200, 100), orientation=6))
+        self.assertTrue(form.is_valid(), form.errors)
+        image = Image.open(form.cleaned_data['image'])
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (32, 64))
+        self.assertNotIn('exif', image.info)
+
+    def test_small_image_is_kept_as_is(self):
+        """Картинка в пределах размера без EXIF сохраняется без изменений"""
+        upload = photo((40, 20), format='PNG', name='small.png')
+        form = self.clean(upload)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIs(form.cleaned_data['image'], upload)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels_is_rejected(self):
+        """Картинка, которую пришлось бы декодировать целиком, отклоняется
+        по размерам из заголовка
+        """
+        form = self.clean(photo((20, 20), format='PNG', name='wide.png'))
+        self.assertEqual(
+            form.errors['image'], ['Картинка 20x20 слишком большая.'])
+
+    def test_large_animation_is_rejected(self):
+        """Большая анимация отклоняется, а не сплющивается в один кадр"""
+        for format, name in (('GIF', 'anim.gif'), ('WEBP', 'anim.webp')):
+            with self.subTest(format=format):
+                buffer = BytesIO()
+                frames = [Image.new('RGB', (100, 50), color)
+                          for color in ('red', 'blue')]
+                frames[0].save(buffer, format, save_all=True,
+                               append_images=frames[1:])
+                form = self.clean(SimpleUploadedFile(
+                    name=name, content=buffer.getvalue()))
+                self.assertEqual(form.errors['image'], [
+                    'Анимация должна быть не больше 64 пикселей по '
+                    'длинной стороне и без EXIF.'
+                ])
+
+    def test_post_create_stores_shrunk_original(self):
+        """Пост сохраняет уменьшенный оригинал"""
+        user = User.objects.create_user(username='mobile')
+        self.client.force_login(user)
+        self.client.post(reverse('posts:post_create'), {
+            'text': 'С телефона', 'image': photo((300, 150)),
+        })
+        post = Post.objects.get(text='С телефона')
+        self.assertEqual(
+            (post.image.width, post.image.height), (64, 32))
@@ -1,14 +1,24 @@
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from .test_forms import TEMP_MEDIA_ROOT
-from ..models import Post, Group, Comment, Follow
+from ..caching import bump_feed_versions, cache_stats, flush_cache_stats
+from ..models import AuthorStats, Post, Group, Comment, Follow, Likes
+from ..negative import key_filter
+from ..rows import FeedRow
+from ..units import COMMENTS_N, MESSAGE_N
 from django import forms
 
 User = get_user_model()
@@ -162,7 +172,7 @@ class PostPagesTests(TestCase):
         response = self.authorized_client.get(
             reverse('posts:postsname', kwargs={'slug': another_group.slug})
         )
-        self.assertEqual(len(response.context['page_obj']), 1)
+        self.assertEqual(len(response.context['page_obj']), 0)
 
     def test_cache_index(self):
         """Тестирование кэширования главной страницы."""
@@ -202,9 +212,11 @@ class PostPagesTests(TestCase):
 
     def test_error_page(self):
         """Несуществующая страница выдаёт ошибку 404 с кастомным шаблоном."""
-        response = self.client.get('/nonexist-page/')
+        response = self.client.get('/nonexist-page/<b>')
         self.assertEqual(response.status_code, 404)
-        self.assertTemplateUsed(response, 'core/404.html')
+        self.assertContains(response, 'Custom 404', status_code=404)
+        self.assertContains(
+            response, '/nonexist-page/&lt;b&gt;', status_code=404)
 
     def test_authorized_user_can_follow_other_users(self):
         """Авторизованный пользователь может подписываться на авторов"""
@@ -301,3 +313,578 @@ class PaginatorTests(TestCase):
             reverse('posts:profile',
                     kwargs={'username': self.user.username}) + '?page=2'))
         self.assertEqual(len(response.context['page_obj']), 3)
+
+    def test_cursor_pages_index(self):
+        """Курсор ведёт на следующую страницу и обратно без COUNT(*)"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(reverse('posts:index'))
+        first_page = list(response.context['page_obj'])
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT COUNT(*) AS "__count" FROM '
+                                    '"posts_post"')
+            for query in queries.captured_queries
+        ))
+        next_cursor = response.context['page_obj'].next_cursor
+        response = self.authorized_client.get(
+            reverse('posts:index'), {'cursor': next_cursor})
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), 3)
+        self.assertEqual(page_obj.number, 2)
+        self.assertFalse(page_obj.has_next())
+        response = self.authorized_client.get(
+            reverse('posts:index'), {'cursor': page_obj.previous_cursor})
+        self.assertEqual(list(response.context['page_obj']), first_page)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_broken_cursor_index(self):
+        """Битый курсор отдаёт первую страницу"""
+        response = self.authorized_client.get(
+            reverse('posts:index'), {'cursor': 'broken'})
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_broken_cursors_share_first_page_cache(self):
+        """Битые курсоры не заводят в кэше своих записей"""
+        cache.clear()
+        self.authorized_client.get(reverse('posts:index'))
+        backend = caches['default']
+        with mock.patch.object(
+            backend, '_write', wraps=backend._write
+        ) as write:
+            for token in ('forged-1', 'forged-2'):
+                response = self.authorized_client.get(
+                    reverse('posts:index'), {'cursor': token})
+                self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(write.call_count, 0)
+
+    def test_feed_count_is_cached(self):
+        """Число постов ленты берётся из кэша и сбрасывается новым постом"""
+        cache.clear()
+        self.authorized_client.get(reverse('posts:index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'].paginator.count, 13)
+        self.assertFalse(any(
+            'COUNT(*)' in query['sql'] and '"posts_post"' in query['sql']
+            for query in queries.captured_queries
+        ))
+        Post.objects.create(text='Ещё пост', author=self.user)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'].paginator.count, 14)
+
+    @override_settings(PAGINATOR_EXACT_COUNT_LIMIT=5)
+    def test_feed_count_is_estimated(self):
+        """За порогом число постов оценивается, последней страницы нет"""
+        cache.clear()
+        response = self.authorized_client.get(reverse('posts:index'))
+        page_obj = response.context['page_obj']
+        self.assertTrue(page_obj.count_estimated)
+        self.assertGreater(page_obj.paginator.count, 5)
+        self.assertNotContains(response, 'Последняя')
+
+    @override_settings(PAGINATOR_WINDOW=1)
+    def test_page_links_window(self):
+        """Паджинатор показывает только окно номеров страниц"""
+        cache.clear()
+        Post.objects.bulk_create(
+            Post(text=f'Post {i}', author=self.user) for i in range(40))
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?page=3')
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.last_number, 6)
+        self.assertEqual(list(page_obj.page_window), [2, 3, 4])
+        self.assertNotContains(response, '?page=1"')
+
+
+class FeedQueriesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='queries',
+            description='Тестовое описание',
+        )
+        cls.authors = [
+            User.objects.create_user(username=f'author{i}')
+            for i in range(MESSAGE_N)
+        ]
+        Follow.objects.bulk_create(
+            Follow(user=cls.user, author=author) for author in cls.authors)
+        cls.client_user = Client()
+        cls.client_user.force_login(cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def create_posts(self, count):
+        for author in self.authors[:count]:
+            post = Post.objects.create(
+                author=author, text='Пост', group=self.group)
+            Likes.toggle(self.user, post.pk)
+            Likes.toggle(author, post.pk)
+
+    def feed_urls(self):
+        return {
+            reverse('posts:index'): 3,
+            reverse('posts:postsname', args=[self.group.slug]): 3,
+            reverse('posts:profile', args=[self.authors[0].username]): 5,
+            reverse('posts:follow_index'): 4,
+        }
+
+    def test_feed_queries_do_not_depend_on_page_size(self):
+        """Ленты выполняют одно и то же число запросов на любой странице"""
+        for posts_count in (1, MESSAGE_N):
+            self.create_posts(posts_count)
+            for url, queries in self.feed_urls().items():
+                with self.subTest(url=url, posts=posts_count):
+                    self.client_user.get(url)
+                    with self.assertNumQueries(queries):
+                        response = self.client_user.get(url)
+                    self.assertTrue(all(
+                        post.is_liked for post in response.context['page_obj']
+                    ))
+
+
+class AuthorStatsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='writer')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def stats(self, user):
+        stats = AuthorStats.objects.get(user=user)
+        return (
+            stats.posts_count, stats.followers_count, stats.following_count)
+
+    def test_signals_update_stats(self):
+        """Посты и подписки меняют счётчики автора и подписчика"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.stats(self.author), (1, 1, 0))
+        self.assertEqual(self.stats(self.reader), (0, 0, 1))
+        post.delete()
+        follow.delete()
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+        self.assertEqual(self.stats(self.reader), (0, 0, 0))
+
+    def test_deleting_user_with_posts_and_follows(self):
+        """Удаление автора с постами и подписками не воссоздаёт его
+        статистику, а разошедшийся счётчик не уходит ниже нуля
+        """
+        author = User.objects.create_user(username='leaving')
+        post = Post.objects.create(author=author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Ответ')
+        Follow.objects.create(user=self.reader, author=author)
+        Follow.objects.create(user=author, author=self.author)
+        AuthorStats.objects.filter(user=self.reader).update(following_count=0)
+        Post.objects.filter(pk=post.pk).update(comment_count=0)
+        author_id = author.pk
+        author.delete()
+        connection.check_constraints()
+        self.assertFalse(AuthorStats.objects.filter(user=author_id).exists())
+        self.assertEqual(self.stats(self.reader), (0, 0, 0))
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+
+    def test_profile_shows_stats(self):
+        """Профиль и страница поста берут счётчики из статистики"""
+        group = Group.objects.create(
+            title='Группа', slug='stats', description='Описание')
+        post = Post.objects.create(
+            author=self.author, text='Пост', group=group)
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.client.get(
+            reverse('posts:profile', args=[self.author.username]))
+        self.assertEqual(response.context['stats'].posts_count, 1)
+        self.assertEqual(response.context['stats'].followers_count, 1)
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk]))
+        self.assertEqual(response.context['stats'].posts_count, 1)
+
+    def test_repair_author_stats(self):
+        """Команда ремонта пересчитывает разошедшуюся статистику"""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Пост {i}') for i in range(3))
+        AuthorStats.objects.filter(user=self.reader).delete()
+        call_command('repair_author_stats', chunk_size=1, stdout=StringIO())
+        self.assertEqual(self.stats(self.author), (3, 0, 0))
+        self.assertEqual(self.stats(self.reader), (0, 0, 0))
+
+
+class CommentsPageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='commentator')
+        cls.group = Group.objects.create(
+            title='Группа', slug='comments', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Пост', group=cls.group)
+        cls.url = reverse('posts:post_detail', args=[cls.post.pk])
+
+    def setUp(self):
+        cache.clear()
+        # Фильтр ключей строится раз в NEGATIVE_FILTER_REBUILD секунд и в
+        # замеры страницы не входит.
+        key_filter('post')
+
+    def add_comments(self, count):
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user, text=f'Комментарий {i}')
+            for i in range(count)
+        )
+        Post.objects.filter(pk=self.post.pk).update(
+            comment_count=self.post.comments.count())
+        bump_feed_versions([f'post:{self.post.pk}'])
+
+    def test_comment_count_follows_comments(self):
+        """Счётчик комментариев поста меняется при добавлении и удалении"""
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+    def test_comments_cursor_pages(self):
+        """Комментарии идут по порядку и листаются курсором"""
+        self.add_comments(COMMENTS_N + 5)
+        response = self.client.get(self.url)
+        first = list(response.context['comments'])
+        self.assertEqual(len(first), COMMENTS_N)
+        self.assertEqual(first[0].text, 'Комментарий 0')
+        response = self.client.get(
+            self.url, {'cursor': response.context['comments'].next_cursor})
+        second = list(response.context['comments'])
+        self.assertEqual(len(second), 5)
+        self.assertFalse({c.pk for c in first} & {c.pk for c in second})
+
+    def test_detail_queries_do_not_depend_on_thread_length(self):
+        """Страница поста выполняет одно и то же число запросов"""
+        for count in (1, COMMENTS_N * 5):
+            self.add_comments(count)
+            with self.subTest(comments=count):
+                with self.assertNumQueries(3):
+                    self.client.get(self.url)
+                with self.assertNumQueries(2):
+                    self.client.get(self.url)
+
+
+class FeedCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='cached')
+        cls.post = Post.objects.create(author=cls.user, text='Первый пост')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    def setUp(self):
+        flush_cache_stats()
+        cache.clear()
+
+    def index_posts(self):
+        response = self.authorized_client.get(reverse('posts:index'))
+        return list(response.context['page_obj'])
+
+    def test_page_is_served_from_cache(self):
+        """Повторный запрос ленты берёт записи из кэша"""
+        self.index_posts()
+        Post.objects.filter(pk=self.post.pk).update(text='Изменён в обход')
+        self.assertEqual(self.index_posts()[0].text, 'Первый пост')
+        self.assertEqual(cache_stats(['feed_page'])['feed_page'], (1, 1, 0))
+
+    def test_cached_page_hit_does_not_write(self):
+        """Повторный запрос ленты из кэша ничего не пишет в кэш"""
+        self.index_posts()
+        self.index_posts()
+        backend = caches['default']
+        with mock.patch.object(
+            backend, '_write', wraps=backend._write
+        ) as write:
+            self.index_posts()
+        self.assertEqual(write.call_count, 0)
+        self.assertEqual(cache_stats(['feed_page'])['feed_page'], (2, 1, 0))
+
+    def test_signals_bump_feed_version(self):
+        """Новый пост и лайк сразу видны в закэшированной ленте"""
+        self.index_posts()
+        post = Post.objects.create(author=self.user, text='Второй пост')
+        self.assertEqual(self.index_posts()[0], post)
+        Likes.toggle(self.user, self.post.pk)
+        self.assertEqual(self.index_posts()[1].like_count, 1)
+
+    def test_viewers_share_rendered_fragment(self):
+        """Авторизованный зритель получает общий HTML со своими лайками"""
+        self.client.get(reverse('posts:index'))
+        Likes.toggle(self.user, self.post.pk)
+        self.client.get(reverse('posts:index'))
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(cache_stats(['feed_fragment'])['feed_fragment'],
+                         (1, 2, 0))
+        content = response.content.decode()
+        self.assertNotIn('<!--hole:', content)
+        self.assertIn('src="/static/img/unlike.png"', content)
+        self.assertIn('name="csrfmiddlewaretoken"', content)
+        anonymous = self.client.get(reverse('posts:index')).content.decode()
+        self.assertNotIn('src="/static/img/unlike.png"', anonymous)
+
+    def test_cache_stats_command(self):
+        """Команда cache_stats показывает долю попаданий"""
+        self.index_posts()
+        self.index_posts()
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertIn('feed_page: попаданий 1, промахов 1', out.getvalue())
+
+    def test_cached_page_holds_compact_rows(self):
+        """В кэше страницы лежат компактные строки, а не модели"""
+        self.index_posts()
+        row = self.index_posts()[0]
+        self.assertIsInstance(row, FeedRow)
+        self.assertEqual(row, self.post)
+        self.assertEqual(row.author.username, self.user.username)
+        self.assertFalse(hasattr(row, '__dict__'))
+
+    def test_benchmark_feed_rows_command(self):
+        """Страница из строк меньше страницы из моделей"""
+        out = StringIO()
+        call_command('benchmark_feed_rows', pages=2, repeat=1, stdout=out)
+        sizes = {
+            line.split(':')[0].strip(): int(line.split()[1])
+            for line in out.getvalue().splitlines()
+        }
+        self.assertLess(sizes['rows'], sizes['models'])
+        self.assertTrue(Post.objects.filter(pk=self.post.pk).exists())
+        self.assertEqual(Post.objects.count(), 1)
+
+
+class PostCardTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='card')
+        cls.post = Post.objects.create(author=cls.user, text='Старый текст')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    def setUp(self):
+        flush_cache_stats()
+        cache.clear()
+
+    def test_card_is_shared_between_feeds(self):
+        """Карточка отрисовывается один раз и нужна во всех лентах"""
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:profile', args=[self.user.username]))
+        self.assertEqual(cache_stats(['post_card'])['post_card'], (1, 1, 0))
+
+    def test_post_edit_invalidates_card(self):
+        """После правки поста карточка показывает новый текст"""
+        self.client.get(reverse('posts:index'))
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=[self.post.pk]),
+            {'text': 'Новый текст'},
+        )
+        response = self.client.get(
+            reverse('posts:profile', args=[self.user.username]))
+        self.assertContains(response, 'Новый текст')
+        self.assertNotContains(response, 'Старый текст')
+
+    def test_author_and_group_changes_invalidate_card(self):
+        """Карточка показывает новые имя автора и название группы, а
+        после удаления группы теряет ссылку на неё
+        """
+        group = Group.objects.create(
+            title='Старая группа', slug='old-slug', description='Описание')
+        post = Post.objects.create(
+            author=self.user, text='Пост группы', group=group)
+        url = reverse('posts:index')
+        self.assertContains(self.client.get(url), 'Старая группа')
+        group.title, group.slug = 'Новая группа', 'new-slug'
+        group.save()
+        self.user.first_name = 'Новое'
+        self.user.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Новая группа')
+        self.assertContains(response, 'new-slug')
+        self.assertNotContains(response, 'old-slug')
+        self.assertContains(response, 'Новое')
+        group.delete()
+        response = self.client.get(url)
+        self.assertNotContains(response, 'new-slug')
+        self.assertContains(response, 'Пост группы')
+        post.delete()
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='etag')
+        cls.group = Group.objects.create(
+            title='Группа', slug='etag', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Пост', group=cls.group)
+        cls.urls = [
+            reverse('posts:index'),
+            reverse('posts:postsname', args=[cls.group.slug]),
+            reverse('posts:profile', args=[cls.user.username]),
+            reverse('posts:post_detail', args=[cls.post.pk]),
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unchanged_page_returns_304(self):
+        """Неизменённая страница отдаёт 304 без рендеринга шаблона"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                # Первый ответ ставит cookie CSRF, от неё зависит ETag.
+                self.client.get(url)
+                response = self.client.get(url)
+                self.assertTrue(response.has_header('ETag'))
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+
+    def test_if_modified_since(self):
+        """If-Modified-Since с датой изменения страницы даёт 304"""
+        self.client.get(self.urls[0])
+        response = self.client.get(self.urls[0])
+        response = self.client.get(
+            self.urls[0], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_and_viewer_change_etag(self):
+        """Новый комментарий и другой зритель меняют ETag"""
+        url = self.urls[3]
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_following_changes_follower_profile_etag(self):
+        """Подписка и отписка меняют ETag профиля самого подписчика"""
+        author = User.objects.create_user(username='etag-author')
+        url = self.urls[2]
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        follow = Follow.objects.create(user=self.user, author=author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        follow.delete()
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class LikesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='liker')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    def like(self):
+        return self.authorized_client.post(
+            reverse('posts:post_like'), {'post_id': self.post.pk})
+
+    def test_like_toggle_updates_counter(self):
+        """Лайк ставится и снимается, счётчик меняется в базе"""
+        self.like()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertTrue(
+            Likes.objects.filter(user=self.user, post=self.post).exists())
+        self.like()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertFalse(Likes.objects.exists())
+
+    def test_like_toggle_queries(self):
+        """Переключение лайка выполняет постоянное число запросов"""
+        self.like()
+        with self.assertNumQueries(5):
+            Likes.toggle(self.user, self.post.pk)
+        with self.assertNumQueries(8):
+            Likes.toggle(self.user, self.post.pk)
+
+    def test_reconcile_like_counts(self):
+        """Команда сверки чинит разошедшиеся счётчики лайков"""
+        Likes.objects.create(user=self.user, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(like_count=7)
+        call_command(
+            'reconcile_like_counts', chunk_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+    def test_like_json_response(self):
+        """AJAX-лайк возвращает JSON с новым состоянием и счётчиком"""
+        response = self.authorized_client.post(
+            reverse('posts:post_like'), {'post_id': self.post.pk},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {
+            'post_id': self.post.pk, 'liked': True, 'like_count': 1})
+
+    def test_like_bad_post_id(self):
+        """Нечисловой или пустой post_id даёт 400, несуществующий — 404"""
+        url = reverse('posts:post_like')
+        for data in ({'post_id': 'abc'}, {}):
+            with self.subTest(data=data):
+                response = self.authorized_client.post(url, data)
+                self.assertEqual(response.status_code, 400)
+        response = self.authorized_client.post(
+            url, {'post_id': self.post.pk + 1000})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Likes.objects.exists())
+
+    def test_like_redirects_back(self):
+        """Обычный лайк возвращает на ту же страницу, но не на чужой сайт"""
+        back = reverse('posts:index') + '?page=2'
+        response = self.authorized_client.post(
+            reverse('posts:post_like'), {'post_id': self.post.pk},
+            HTTP_REFERER=back)
+        self.assertRedirects(response, back, fetch_redirect_response=False)
+        response = self.authorized_client.post(
+            reverse('posts:post_like'), {'post_id': self.post.pk},
+            HTTP_REFERER='https://evil.example/')
+        self.assertRedirects(response, reverse('posts:index'))
+
+    def test_like_script_on_every_feed(self):
+        """Скрипт лайков подключён во всех лентах с формой лайка"""
+        other = User.objects.create_user(username='followed')
+        Follow.objects.create(user=self.user, author=other)
+        Post.objects.create(author=other, text='Пост из подписки')
+        for url in (reverse('posts:index'), reverse('posts:follow_index')):
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, 'js-like')
+                self.assertContains(response, 'js/likes.js', count=1)
+
+    def test_likes_state(self):
+        """Состояние лайков отдаётся пачкой по списку id"""
+        other = Post.objects.create(author=self.user, text='Другой пост')
+        Likes.toggle(self.user, self.post.pk)
+        response = self.authorized_client.get(
+            reverse('posts:post_like_state'),
+            {'ids': f'{self.post.pk},{other.pk}'})
+        self.assertEqual(response.json(), {'likes': {
+            str(self.post.pk): {'liked': True, 'like_count': 1},
+            str(other.pk): {'liked': False, 'like_count': 0},
+        }})
+        response = self.client.get(
+            reverse('posts:post_like_state'), {'ids': 'x'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,345 @@
+"""Миниатюры картинок постов, которые готовятся при загрузке.
+
+post_create и post_edit ставят пост в очередь: строку ThumbnailJob в
+базе. Её разбирает отдельный процесс manage.py thumbnail_worker, а не
+веб-воркер: нарезка картинки 2048x1536 во все размеры и варианты
+занимает около 2 секунд процессора, и веб-воркер, который резал бы её
+после ответа, столько же не принимал бы запросы. Один процесс
+thumbnail_worker успевает около 0,5 картинки в секунду; при большем
+потоке загрузок процессов запускают несколько. Упавшая задача
+повторяется с растущей паузой. Миниатюры всех размеров из
+POST_THUMBNAILS режет sorl-thumbnail (движок на Pillow) вместе с
+вариантами для srcset: несколько ширин в WebP и JPEG. Адреса, размеры
+и крошечная заглушка LQIP записываются в Post.thumbnails. Шаблоны
+читают готовые данные и не трогают картинку во время запроса; пока
+миниатюр нет, выводится оригинал.
+"""
+import logging
+from base64 import b64encode
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from . import feeds
+from .caching import bump_feed_versions
+from .models import Post, ThumbnailJob
+
+logger = logging.getLogger(__name__)
+
+# Тег EXIF с поворотом снимка
+ORIENTATION = 0x0112
+
+
+def variants(alias, source):
+    """(формат, геометрия, опции) миниатюр алиаса для srcset.
+
+    Все варианты вырезаются в пропорциях геометрии алиаса. Исходник
+    source (ширина, высота) не увеличивается: ширины больше той, что
+    помещается в него с этими пропорциями, заменяются на неё.
+    """
+    geometry, options = settings.POST_THUMBNAILS[alias]
+    width, height = (int(side) for side in geometry.split('x'))
+    largest = max(1, min(source[0], source[1] * width // height))
+    widths = sorted({
+        min(variant, largest) for variant in settings.POST_THUMBNAIL_WIDTHS
+    })
+    for format in settings.POST_THUMBNAIL_FORMATS:
+        for variant in widths:
+            variant_height = max(1, round(variant * height / width))
+            yield format, f'{variant}x{variant_height}', {
+                **options, 'upscale': False, 'format': format,
+            }
+
+
+def source_size(name):
+    """Ширина и высота картинки name с учётом поворота из EXIF, как её
+    видит sorl. Читается только заголовок файла.
+    """
+    with default.storage.open(name) as source:
+        image = Image.open(source)
+        size = image.size
+        if image.getexif().get(ORIENTATION) in (5, 6, 7, 8):
+            size = size[::-1]
+    return size
+
+
+def lqip(thumbnail):
+    """Размытая заглушка миниатюры thumbnail в виде data: URI."""
+    width = settings.POST_THUMBNAIL_LQIP_WIDTH
+    with default.storage.open(thumbnail.name) as source:
+        image = Image.open(source)
+        image.draft('RGB', (width, width))
+        image = image.convert('RGB')
+        image.thumbnail((width, width))
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=40, optimize=True)
+    return 'data:image/jpeg;base64,' + b64encode(buffer.getvalue()).decode()
+
+
+def render_thumbnails(image, force=False):
+    """Миниатюры картинки image во всех размерах POST_THUMBNAILS.
+
+    Для каждого размера режутся варианты srcset и заглушка lqip.
+    force заново режет миниатюры, которые sorl уже сделал.
+    """
+    name = getattr(image, 'name', image)
+    source = source_size(name)
+    thumbnails = {}
+    for alias, (geometry, options) in settings.POST_THUMBNAILS.items():
+        specs = [(None, geometry, options), *variants(alias, source)]
+        if force:
+            for _, spec_geometry, spec_options in specs:
+                thumbnail = sorl_thumbnail_file(
+                    name, spec_geometry, spec_options)
+                default.kvstore.delete(thumbnail, delete_thumbnails=False)
+                thumbnail.delete()
+        thumbnail = get_thumbnail(image, geometry, **options)
+        sources = {}
+        for format, spec_geometry, spec_options in specs[1:]:
+            variant = get_thumbnail(image, spec_geometry, **spec_options)
+            sources.setdefault(format.lower(), []).append(
+                [variant.url, variant.width, variant.height])
+        thumbnails[alias] = {
+            'url': thumbnail.url,
+            'width': thumbnail.width,
+            'height': thumbnail.height,
+            'source': list(source),
+            'sources': sources,
+            'lqip': lqip(thumbnail),
+        }
+    return thumbnails
+
+
+def generate_thumbnails(post_id):
+    """Готовит миниатюры поста и сбрасывает закэшированные ленты."""
+    post = Post.objects.filter(pk=post_id).only(
+        'image', 'author', 'group'
+    ).first()
+    if post is None or not post.image:
+        return
+    if save_thumbnails(post, render_thumbnails(post.image)):
+        bump_feed_versions(feeds.feed_keys(post) | {f'post:{post_id}'})
+
+
+def save_thumbnails(post, thumbnails):
+    """Записывает миниатюры, если картинка поста не сменилась.
+
+    updated_at меняется вместе с ними: ключ кэша карточки устаревает.
+    """
+    return bool(Post.objects.filter(
+        pk=post.pk, image=getattr(post.image, 'name', post.image)
+    ).update(thumbnails=thumbnails, updated_at=timezone.now()))
+
+
+def is_up_to_date(post):
+    """Все размеры POST_THUMBNAILS и их варианты записаны для текущих
+    геометрий и форматов.
+
+    Имя файла sorl зависит от геометрии и опций: после их смены
+    записанный адрес перестаёт совпадать с ожидаемым.
+    """
+    thumbnails = post.thumbnails or {}
+    for alias, (geometry, options) in settings.POST_THUMBNAILS.items():
+        thumbnail = thumbnails.get(alias, {})
+        if 'lqip' not in thumbnail or 'source' not in thumbnail:
+            return False
+        expected = [(None, sorl_thumbnail_file(
+            post.image.name, geometry, options))]
+        expected += [
+            (format.lower(), sorl_thumbnail_file(
+                post.image.name, spec_geometry, spec_options))
+            for format, spec_geometry, spec_options
+            in variants(alias, thumbnail['source'])
+        ]
+        for format, file in expected:
+            urls = (
+                {thumbnail.get('url')} if format is None else
+                {url for url, *_ in thumbnail['sources'].get(format, ())}
+            )
+            if file.url not in urls or not file.exists():
+                return False
+    return True
+
+
+def queue_thumbnails(post):
+    """Ставит пост в очередь задач миниатюр или сбрасывает его задачу.
+
+    Строка задачи пишется в той же транзакции, что и пост.
+    """
+    if post.image:
+        now = timezone.now()
+        ThumbnailJob.objects.update_or_create(post_id=post.pk, defaults={
+            'queued_at': now, 'run_after': now, 'attempts': 0,
+            'last_error': '',
+        })
+
+
+def claim_jobs(limit):
+    """Забирает до limit задач, срок которых наступил.
+
+    Условный UPDATE по прежнему run_after отдаёт задачу одному воркеру и
+    откладывает её на THUMBNAIL_JOB_LEASE: если воркер упадёт, задачу
+    возьмут снова. Попытка засчитывается сразу, так что картинка,
+    которая роняет процесс, тоже исчерпает THUMBNAIL_JOB_MAX_ATTEMPTS.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.THUMBNAIL_JOB_LEASE)
+    claimed = []
+    for job in ThumbnailJob.objects.filter(
+        run_after__lte=now
+    ).order_by('run_after')[:limit]:
+        if ThumbnailJob.objects.filter(
+            pk=job.pk, run_after=job.run_after
+        ).update(run_after=lease, attempts=F('attempts') + 1):
+            job.attempts += 1
+            claimed.append(job)
+    return claimed
+
+
+def run_job(job):
+    """Режет миниатюры задачи. Ошибка откладывает задачу с растущей
+    паузой, после THUMBNAIL_JOB_MAX_ATTEMPTS попыток задача остаётся с
+    run_after=None для regenerate_thumbnails.
+    """
+    current = ThumbnailJob.objects.filter(
+        pk=job.pk, queued_at=job.queued_at)
+    try:
+        generate_thumbnails(job.post_id)
+    except Exception as error:
+        logger.exception(
+            'Не удалось подготовить миниатюры поста %s', job.post_id)
+        retry = None
+        if job.attempts < settings.THUMBNAIL_JOB_MAX_ATTEMPTS:
+            retry = timezone.now() + timedelta(
+                seconds=settings.THUMBNAIL_JOB_RETRY * 2 ** (job.attempts - 1)
+            )
+        current.update(
+            run_after=retry, last_error=f'{type(error).__name__}: {error}')
+        return False
+    current.delete()
+    return True
+
+
+def run_jobs(limit):
+    """Выполняет до limit задач; список успехов по задачам."""
+    return [run_job(job) for job in claim_jobs(limit)]
+
+
+def sorl_thumbnail_file(name, geometry, options):
+    """ImageFile миниатюры, которую sorl сделал бы для картинки name.
+
+    Повторяет выбор имени файла из ThumbnailBackend.get_thumbnail, но
+    не читает KV-хранилище и не режет картинку.
+    """
+    backend = default.backend
+    source = ImageFile(name)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, geometry, options),
+        default.storage,
+    )
+
+
+def sorl_thumbnails(files):
+    """Готовые миниатюры sorl для files: {key: {'url', 'width', 'height'}}.
+
+    Записи KV-хранилища читаются одним get_many из кэша sorl и одним
+    запросом к таблице за тем, чего нет в кэше.
+    """
+    keys = {add_prefix(image.key): image.key for image in files}
+    if not keys:
+        return {}
+    values = {
+        key: value
+        for key, value in default.kvstore.cache.get_many(list(keys)).items()
+        if isinstance(value, str)
+    }
+    missing = [key for key in keys if key not in values]
+    if missing:
+        values.update(KVStore.objects.filter(
+            key__in=missing
+        ).values_list('key', 'value'))
+    thumbnails = {}
+    for key, value in values.items():
+        image = deserialize_image_file(value)
+        thumbnails[keys[key]] = {
+            'url': image.url, 'width': image.width, 'height': image.height,
+        }
+    return thumbnails
+
+
+def attach_thumbnails(posts, alias='card'):
+    """Дополняет миниатюрами страницу постов перед рендерингом.
+
+    Посты, загруженные до фоновой подготовки миниатюр, хранят пустые
+    метаданные. Для них уже нарезанные sorl миниатюры находятся одним
+    пакетным чтением на всю страницу, а не запросом на каждую карточку.
+    """
+    pending = [
+        post for post in posts
+        if post.image and alias not in (post.thumbnails or {})
+    ]
+    if not pending:
+        return
+    geometry, options = settings.POST_THUMBNAILS[alias]
+    files = {
+        post.pk: sorl_thumbnail_file(
+            getattr(post.image, 'name', post.image), geometry, options
+        )
+        for post in pending
+    }
+    found = sorl_thumbnails(files.values())
+    for post in pending:
+        thumbnail = found.get(files[post.pk].key)
+        if thumbnail is not None:
+            post.thumbnails = {**(post.thumbnails or {}), alias: thumbnail}
+
+
+def srcset(sources):
+    """Значение атрибута srcset; совпавшие ширины выводятся один раз."""
+    widths = {}
+    for url, width, *_ in sources:
+        widths.setdefault(width, url)
+    return ', '.join(f'{url} {width}w' for width, url in widths.items())
+
+
+def thumbnail_for(post, alias):
+    """Готовая миниатюра или оригинал, пока миниатюр нет.
+
+    post — модель или FeedRow, у которой image хранит имя файла. У
+    нарезанной миниатюры есть srcset по форматам и sizes для шаблона.
+    """
+    thumbnail = (post.thumbnails or {}).get(alias)
+    if thumbnail is not None:
+        sources = thumbnail.get('sources')
+        if not sources:
+            return thumbnail
+        return {
+            **thumbnail,
+            'srcset': {
+                format: srcset(urls) for format, urls in sources.items()
+            },
+            'sizes': settings.POST_THUMBNAIL_SIZES,
+        }
+    name = getattr(post.image, 'name', post.image)
+    if name:
+        return {'url': default_storage.url(name)}
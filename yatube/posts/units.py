@@ -1,10 +1,362 @@
-from django.core.paginator import Paginator
+from hashlib import md5
+from math import ceil
+
+from django.conf import settings
+from django.core import signing
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import F, Max, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .caching import (bump_feed_versions, feed_version, feed_versions,
+                      single_flight)
+from .rows import FeedRow
 
 MESSAGE_N = 10
+COMMENTS_N = 20
+CURSOR_SALT = 'posts.cursor'
+COUNT_CACHE_KEY = 'posts:count:{}'
+PAGE_CACHE_KEY = 'posts:page:{}:{}:{}'
+PAGE_CACHE = 'feed_page'
+COUNT_CACHE = 'feed_count'
+
+
+def encode_cursor(key, number, backward=False):
+    """Упаковывает ключ (pub_date, pk) и номер страницы в токен."""
+    pub_date, pk = key
+    return signing.dumps(
+        [pub_date.isoformat(), pk, number, int(backward)],
+        salt=CURSOR_SALT,
+    )
+
+
+def decode_cursor(token):
+    """Возвращает (key, number, backward) или None для битого токена."""
+    try:
+        pub_date, pk, number, backward = signing.loads(
+            token, salt=CURSOR_SALT
+        )
+        pub_date = parse_datetime(pub_date)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if pub_date is None:
+        return None
+    return (pub_date, pk), number, bool(backward)
+
+
+class QuerySetFeed:
+    """Лента поверх queryset, упорядоченная по ключу (pub_date, pk).
+
+    Окно ленты выбирается условием по ключу, а не OFFSET, поэтому
+    глубокие страницы стоят столько же, сколько первая. По умолчанию
+    новые записи идут первыми, ascending=True переворачивает порядок.
+    """
+
+    key_fields = ('pub_date', 'pk')
+
+    def __init__(self, queryset, where=None, key_fields=None,
+                 ascending=False):
+        self.queryset = queryset
+        self.where = where
+        self.ascending = ascending
+        if key_fields is not None:
+            self.key_fields = key_fields
+
+    def count(self, limit=None):
+        queryset = self._filter()
+        if limit is not None:
+            queryset = queryset.order_by()[:limit]
+        return queryset.count()
+
+    def estimate(self):
+        """Дешёвая оценка размера для ленты без условий: по MAX(pk)."""
+        if self.where is not None or self.queryset.query.where:
+            return None
+        return self.queryset.aggregate(last=Max('pk'))['last'] or 0
+
+    def _filter(self, *conditions):
+        # Все условия передаются в один filter(), чтобы условия по
+        # многозначным связям использовали один и тот же JOIN.
+        if self.where is not None:
+            conditions = (self.where,) + conditions
+        return self.queryset.filter(*conditions)
+
+    def _keyset(self, key, lookup):
+        date_field, pk_field = self.key_fields
+        pub_date, pk = key
+        return (
+            Q(**{f'{date_field}__{lookup}e': pub_date})
+            & (Q(**{f'{date_field}__{lookup}': pub_date})
+               | Q(**{f'{pk_field}__{lookup}': pk}))
+        )
+
+    def window(self, after=None, before=None, offset=0, limit=MESSAGE_N):
+        """Возвращает до limit записей после или до ключа.
+
+        Записи «до» ключа (before) возвращаются в обратном порядке,
+        то есть ближайшие к ключу идут первыми.
+        """
+        forward, backward = ('gt', 'lt') if self.ascending else ('lt', 'gt')
+        # F() не даёт Django подменить сортировку по связи на
+        # Meta.ordering связанной модели.
+        ordering = [F(field) for field in self.key_fields]
+        if before is not None:
+            queryset = self._filter(self._keyset(before, backward)).order_by(
+                *(self._order(field, not self.ascending) for field in ordering)
+            )
+        else:
+            conditions = ()
+            if after is not None:
+                conditions = (self._keyset(after, forward),)
+            queryset = self._filter(*conditions).order_by(
+                *(self._order(field, self.ascending) for field in ordering)
+            )
+        return list(queryset[offset:offset + limit])
+
+    @staticmethod
+    def _order(field, ascending):
+        return field.asc() if ascending else field.desc()
+
+
+def count_version_key(key):
+    return f'count:{key}'
+
+
+def feed_count(feed, key):
+    """Возвращает (count, estimated) для ленты с ключом key.
+
+    Число записей берётся из кэша под версией числа записей ленты. При
+    промахе записи считаются не дальше PAGINATOR_EXACT_COUNT_LIMIT, а за
+    порогом число оценивается. Лента, собранная из других лент, отдаёт
+    их ключи методом version_keys: версия складывается из их версий, и
+    публикации не нужно сбрасывать версию у каждой такой ленты.
+    """
+    def count():
+        limit = settings.PAGINATOR_EXACT_COUNT_LIMIT
+        count = feed.count(limit=limit + 1)
+        estimated = count > limit
+        if estimated and hasattr(feed, 'estimate'):
+            count = max(count, feed.estimate() or 0)
+        return count, estimated
+
+    keys = [count_version_key(key)]
+    if hasattr(feed, 'version_keys'):
+        keys += [count_version_key(part) for part in feed.version_keys()]
+    versions = feed_versions(keys)
+    version = versions[0]
+    if len(versions) > 1:
+        version = md5(repr(versions).encode()).hexdigest()
+    result, _, _ = single_flight(
+        COUNT_CACHE_KEY.format(key),
+        version,
+        count,
+        COUNT_CACHE,
+        settings.PAGINATOR_COUNT_TIMEOUT,
+        settings.PAGINATOR_COUNT_HARD_TIMEOUT,
+    )
+    return result
+
+
+def invalidate_feeds(keys):
+    """Устаревают страницы и число записей лент.
+
+    Лайки и комментарии меняют только страницы, для них хватает
+    bump_feed_versions.
+    """
+    keys = set(keys)
+    bump_feed_versions(keys | {count_version_key(key) for key in keys})
+
+
+class CursorPaginator(Paginator):
+    """Паджинатор по ключу (pub_date, pk) без COUNT(*) и OFFSET.
+
+    Страница выбирается непрозрачным токеном из ?cursor=, номер
+    страницы ?page= поддерживается для старых ссылок. С versioned=True
+    записи страниц кэшируются под текущей версией ленты feed_key; row
+    превращает запись в компактную строку перед записью в кэш.
+    """
+
+    count_estimated = False
+
+    def __init__(self, feed, per_page, feed_key=None, count=None,
+                 versioned=False, row=None):
+        if not hasattr(feed, 'window'):
+            feed = QuerySetFeed(feed)
+        super().__init__(feed, per_page)
+        self.feed_key = feed_key
+        self.row = row
+        self.versioned = versioned and feed_key is not None
+        if count is not None:
+            # Готовое число записей, например счётчик в модели.
+            self.count = count
+
+    @staticmethod
+    def key(post):
+        return post.pub_date, post.pk
+
+    @cached_property
+    def count(self):
+        if self.feed_key is None:
+            return super().count
+        count, self.count_estimated = feed_count(
+            self.object_list, self.feed_key
+        )
+        return count
+
+    def _page_links(self, page):
+        """Ограниченное окно номеров страниц вокруг текущей."""
+        last = max(
+            ceil(self.count / self.per_page), self.num_pages
+        )
+        window = settings.PAGINATOR_WINDOW
+        page.last_number = last
+        page.count_estimated = self.count_estimated
+        page.page_window = range(
+            max(1, page.number - window), min(last, page.number + window) + 1
+        )
+
+    def _window_page(self, rows, number, has_previous, has_next):
+        number = max(number, 2) if has_previous else 1
+        self.num_pages = number + 1 if has_next else number
+        page = self._get_page(rows, number, self)
+        page.next_cursor = page.previous_cursor = None
+        if rows and has_next:
+            page.next_cursor = encode_cursor(self.key(rows[-1]), number + 1)
+        if rows and has_previous:
+            page.previous_cursor = encode_cursor(
+                self.key(rows[0]), number - 1, backward=True
+            )
+        if self.feed_key is not None or 'count' in self.__dict__:
+            self._page_links(page)
+        return page
+
+    def _head(self, offset=0, after=None):
+        rows = self.object_list.window(
+            after=after, offset=offset, limit=self.per_page + 1
+        )
+        return rows[:self.per_page], len(rows) > self.per_page
+
+    def validate_number(self, number):
+        if 'num_pages' in self.__dict__:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return super().validate_number(number)
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def get_page(self, number):
+        try:
+            return super().get_page(number)
+        except EmptyPage:
+            # Номер за концом ленты: один раз считаем страницы честно.
+            return super().get_page(self.num_pages)
+
+    def _cached(self, marker, build):
+        """Страница из кэша версии ленты; пересобирает её один воркер."""
+        if not self.versioned:
+            return build()
+        cache_key = PAGE_CACHE_KEY.format(
+            self.feed_key, self.per_page, md5(marker.encode()).hexdigest()
+        )
+
+        def window():
+            page = build()
+            rows = page.object_list
+            if self.row is not None:
+                rows = [self.row(obj) for obj in rows]
+            return (rows, page.number,
+                    page.has_previous(), page.has_next())
+
+        rows, version, stale = single_flight(
+            cache_key,
+            feed_version(self.feed_key),
+            window,
+            PAGE_CACHE,
+            settings.FEED_PAGE_SOFT_TIMEOUT,
+            settings.FEED_PAGE_CACHE_TIMEOUT,
+        )
+        page = self._window_page(*rows)
+        page.stale = stale
+        # Тот же ключ с версией данных делит между зрителями HTML страницы.
+        page.fragment_key = f'{cache_key}:{version}'
+        return page
+
+    def page(self, number):
+        number = self.validate_number(number)
+        return self._cached(f'page:{number}', lambda: self._page(number))
+
+    def _page(self, number):
+        rows, has_next = self._head(offset=(number - 1) * self.per_page)
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return self._window_page(rows, number, number > 1, has_next)
+
+    def cursor_page(self, token):
+        """Страница по токену курсора; битый токен даёт первую страницу.
+
+        Токен проверяется до кэша: иначе каждый выдуманный ?cursor=
+        занимал бы в кэше свою запись.
+        """
+        cursor = decode_cursor(token)
+        if cursor is None:
+            return self.page(1)
+        return self._cached(
+            f'cursor:{token}', lambda: self._cursor_page(cursor)
+        )
+
+    def _cursor_page(self, cursor):
+        key, number, backward = cursor
+        if not backward:
+            rows, has_next = self._head(after=key)
+            return self._window_page(rows, number, True, has_next)
+        rows = self.object_list.window(before=key, limit=self.per_page + 1)
+        if len(rows) > self.per_page:
+            return self._window_page(
+                rows[:self.per_page][::-1], number, True, True
+            )
+        # Дошли до начала ленты: отдаём полную первую страницу.
+        return self._page(1)
+
+
+class CommentPaginator(CursorPaginator):
+    """Комментарии по ключу (created, pk), старые идут первыми."""
+
+    def __init__(self, queryset, per_page, count=None, feed_key=None):
+        super().__init__(
+            QuerySetFeed(
+                queryset, key_fields=('created', 'pk'), ascending=True
+            ),
+            per_page,
+            feed_key=feed_key,
+            count=count,
+            versioned=True,
+        )
+
+    @staticmethod
+    def key(comment):
+        return comment.created, comment.pk
+
+
+def paginate(paginator, request):
+    cursor = request.GET.get('cursor')
+    if cursor:
+        page = paginator.cursor_page(cursor)
+    else:
+        page = paginator.get_page(request.GET.get('page'))
+    if getattr(page, 'stale', False):
+        request.served_stale = True
+    return page
 
 
-def paginator_posts(post_list, post_on_page, request):
-    paginator = Paginator(post_list, post_on_page)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
-    return page_obj
+def paginator_posts(post_list, post_on_page, request, feed=None,
+                    versioned=False):
+    return paginate(
+        CursorPaginator(
+            post_list, post_on_page, feed_key=feed, versioned=versioned,
+            row=FeedRow.from_post,
+        ),
+        request,
+    )
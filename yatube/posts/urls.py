@@ -23,5 +23,6 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
-    path('like/', views.likes_post, name='post_like')
+    path('like/', views.likes_post, name='post_like'),
+    path('like/state/', views.likes_state, name='post_like_state'),
 ]
@@ -1,53 +1,125 @@
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Post, Group, User, Follow, Likes
+from django.utils.http import is_safe_url
+from .models import AuthorStats, Post, Group, User, Follow, Likes
 from .forms import PostForm, CommentForm
 from django.contrib.auth.decorators import login_required
-from .units import paginator_posts, MESSAGE_N
+from .units import (
+    paginate, paginator_posts, CommentPaginator, COMMENTS_N, MESSAGE_N
+)
+from .feeds import HybridFeed, mark_liked
+from .caching import condition_on_feeds
+from .identity import get_group_or_404, get_user_or_404, lookup
+from .negative import mark_missing, may_exist
+from .thumbnails import attach_thumbnails, queue_thumbnails
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import View
 
+LIKES_STATE_MAX_IDS = 100
 
+
+def index_state(request):
+    return ['index'], None
+
+
+def group_state(request, slug):
+    group = lookup(Group, slug)
+    if group is not None:
+        return [f'group:{group.pk}'], None
+
+
+def profile_state(request, username):
+    author = lookup(User, username)
+    if author is not None:
+        return [f'profile:{author.pk}'], None
+
+
+def post_state(request, post_id):
+    if not may_exist('post', post_id):
+        raise Http404
+    post = Post.objects.filter(pk=post_id).values_list(
+        'author_id', 'updated_at').first()
+    if post is None:
+        mark_missing('post', post_id)
+        raise Http404
+    author_id, updated_at = post
+    return [f'post:{post_id}', f'profile:{author_id}'], updated_at
+
+
+@condition_on_feeds(index_state)
 def index(request):
     template = 'posts/index.html'
-    post_list = Post.objects.all()
+    post_list = Post.objects.for_feed()
     user = request.user
+    page_obj = paginator_posts(
+        post_list, MESSAGE_N, request, feed='index', versioned=True
+    )
+    mark_liked(page_obj, user)
+    attach_thumbnails(page_obj)
     context = {
-        'page_obj': paginator_posts(post_list, MESSAGE_N, request),
+        'page_obj': page_obj,
         'user': user
     }
     return render(request, template, context)
 
 
+@condition_on_feeds(group_state)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
+    group = get_group_or_404(slug)
     template = 'posts/group_list.html'
-    post_list = Post.objects.all()
+    post_list = group.posts.for_feed()
+    page_obj = paginator_posts(
+        post_list, MESSAGE_N, request, feed=f'group:{group.pk}',
+        versioned=True,
+    )
+    mark_liked(page_obj, request.user)
+    attach_thumbnails(page_obj)
     context = {
         'group': group,
-        'page_obj': paginator_posts(post_list, MESSAGE_N, request)
+        'page_obj': page_obj
     }
     return render(request, template, context)
 
 
+@condition_on_feeds(profile_state)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    user_post_list = author.posts.select_related('author')
+    author = get_user_or_404(username)
+    user_post_list = author.posts.for_feed()
     following = (request.user.is_authenticated and (Follow.objects.filter(
         user=request.user, author=author).exists()))
+    page_obj = paginator_posts(
+        user_post_list, MESSAGE_N, request, feed=f'profile:{author.pk}',
+        versioned=True,
+    )
+    mark_liked(page_obj, request.user)
+    attach_thumbnails(page_obj)
     context = {
-        'page_obj': paginator_posts(user_post_list, MESSAGE_N, request),
+        'page_obj': page_obj,
         'author': author,
+        'stats': AuthorStats.objects.for_user(author),
         'following': following,
 
     }
     return render(request, 'posts/profile.html', context)
 
 
+@condition_on_feeds(post_state)
 def post_detail(request, post_id, ):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__stats'), pk=post_id
+    )
+    attach_thumbnails([post])
     form = CommentForm()
+    comments = paginate(CommentPaginator(
+        post.comments.select_related('author'),
+        COMMENTS_N,
+        count=post.comment_count,
+        feed_key=f'post:{post.pk}',
+    ), request)
     context = {
         'post': post,
+        'stats': AuthorStats.objects.for_user(post.author),
+        'comments': comments,
         'form': form,
     }
     return render(request, 'posts/post_detail.html', context)
@@ -63,6 +135,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        queue_thumbnails(post)
 
         return redirect('posts:profile', post.author)
 
@@ -87,7 +160,12 @@ def post_edit(request, post_id):
         instance=post
     )
     if form.is_valid():
+        image_changed = 'image' in form.changed_data
+        if image_changed:
+            post.thumbnails = {}
         form.save()
+        if image_changed:
+            queue_thumbnails(post)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'post': post,
@@ -111,9 +189,14 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
+    posts = HybridFeed(request.user)
+    page_obj = paginator_posts(
+        posts, MESSAGE_N, request, feed=f'follow:{request.user.pk}'
+    )
+    mark_liked(page_obj, request.user)
+    attach_thumbnails(page_obj)
     context = {
-        'page_obj': paginator_posts(posts, MESSAGE_N, request)
+        'page_obj': page_obj
     }
     return render(request, 'posts/follow.html', context)
 
@@ -121,7 +204,7 @@ def follow_index(request):
 @login_required
 def profile_follow(request, username):
     user = request.user
-    author = get_object_or_404(User, username=username)
+    author = get_user_or_404(username)
     if user != author:
         Follow.objects.get_or_create(user=user, author=author)
     return redirect('posts:profile', username)
@@ -129,32 +212,59 @@ def profile_follow(request, username):
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_user_or_404(username)
     if request.user != author and Follow.objects.filter(
             user=request.user, author=author).exists():
         Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('posts:profile', author)
 
 
+def wants_json(request):
+    return (request.is_ajax()
+            or 'application/json' in request.META.get('HTTP_ACCEPT', ''))
+
+
 @login_required
 def likes_post(request):
-    user = request.user
-    if request.method == 'POST':
-        post_id = request.POST.get('post_id')
-        post_obj = Post.objects.get(id=post_id)
-
-        if user in post_obj.liked.all():
-            post_obj.liked.remove(user)
-        else:
-            post_obj.liked.add(user)
-        like, create = Likes.objects.get_or_create(user=user, post_id=post_id)
-
-        if not create:
-            if like.value == 'Like':
-                like.value = 'Unlike'
-            else:
-                like.value = 'Like'
-        like.save()
+    if request.method != 'POST':
+        return redirect('posts:index')
+    try:
+        post_id = int(request.POST.get('post_id', ''))
+    except ValueError:
+        return HttpResponseBadRequest('post_id должен быть числом')
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    liked = Likes.toggle(request.user, post.pk)
+    if wants_json(request):
+        return JsonResponse({
+            'post_id': post.pk,
+            'liked': liked,
+            'like_count': Post.objects.values_list(
+                'like_count', flat=True
+            ).get(pk=post.pk),
+        })
+    back = request.META.get('HTTP_REFERER')
+    if back and is_safe_url(back, allowed_hosts={request.get_host()},
+                            require_https=request.is_secure()):
+        return redirect(back)
     return redirect('posts:index')
 
 
+def likes_state(request):
+    """Состояние лайков для списка постов: ?ids=1,2,3."""
+    try:
+        ids = {
+            int(post_id)
+            for post_id in request.GET.get('ids', '').split(',') if post_id
+        }
+    except ValueError:
+        return HttpResponseBadRequest('ids должен быть списком чисел')
+    posts = list(Post.objects.filter(
+        pk__in=list(ids)[:LIKES_STATE_MAX_IDS]
+    ).only('pk', 'like_count'))
+    mark_liked(posts, request.user)
+    return JsonResponse({
+        'likes': {
+            post.pk: {'liked': post.is_liked, 'like_count': post.like_count}
+            for post in posts
+        }
+    })
@@ -0,0 +1,40 @@
+// Лайки без перезагрузки страницы. Без JavaScript форма лайка
+// по-прежнему отправляется обычным POST-запросом. Скрипт подключён
+// в base.html: формы лайков есть во всех лентах.
+document.addEventListener('submit', function (event) {
+  var form = event.target;
+  if (!form.classList.contains('js-like') || !window.fetch) {
+    return;
+  }
+  event.preventDefault();
+  fetch(form.action, {
+    method: 'POST',
+    body: new FormData(form),
+    credentials: 'same-origin',
+    headers: {
+      'Accept': 'application/json',
+      'X-Requested-With': 'XMLHttpRequest'
+    }
+  }).then(function (response) {
+    if (response.redirected) {
+      // Гость: лайк не поставлен, ведём на страницу входа.
+      window.location.assign(response.url);
+      return;
+    }
+    if (!response.ok) {
+      // Запрос дошёл до сервера и мог переключить лайк: повторная
+      // отправка переключила бы его обратно. Показываем, что есть.
+      window.location.reload();
+      return;
+    }
+    return response.json().then(function (data) {
+      form.querySelector('.js-like-count').textContent = data.like_count;
+      form.querySelector('.js-like-icon').src = data.liked
+        ? form.dataset.unlikeIcon
+        : form.dataset.likeIcon;
+    });
+  }, function () {
+    // Сетевая ошибка: ответа нет, отправляем форму без скрипта.
+    form.submit();
+  });
+});
@@ -90,6 +90,22 @@ DATABASES = {
     }
 }
 
+# Cache
+# Общий для всех воркеров кэш в локальном файле SQLite, горячие ключи
+# держатся в памяти процесса и сбрасываются по шине инвалидаций
+CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'BUS_KEEP': 10000,
+        },
+    }
+}
+# Тесты получают свой кэш во временном каталоге, см. core/runner.py
+TEST_RUNNER = 'core.runner.TempCacheRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -139,3 +155,81 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Загружаемые картинки постов, см. posts/uploads.py. Оригинал больше
+# POST_IMAGE_MAX_SIDE по длинной стороне уменьшается при загрузке, EXIF
+# удаляются. POST_IMAGE_MAX_PIXELS ограничивает картинки, которые
+# декодируются целиком (PNG, GIF, WebP); JPEG декодируется уменьшенным
+# и допускается в 64 раза больше
+POST_IMAGE_MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+POST_IMAGE_MAX_SIDE = 2048
+POST_IMAGE_MAX_PIXELS = 16 * 1000 * 1000
+POST_IMAGE_QUALITY = 90
+
+# Миниатюры картинок постов: алиас -> (геометрия, опции sorl-thumbnail).
+# Готовятся после загрузки процессом manage.py thumbnail_worker
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+# Для srcset каждый размер дополнительно режется в этих ширинах и
+# форматах, с теми же пропорциями и без увеличения исходника
+POST_THUMBNAIL_WIDTHS = (480, 960, 1440)
+POST_THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+POST_THUMBNAIL_SIZES = '(min-width: 1200px) 1110px, 100vw'
+# Ширина размытой заглушки (LQIP), которая встраивается в страницу
+POST_THUMBNAIL_LQIP_WIDTH = 24
+# Задачи миниатюр: сколько секунд задача принадлежит взявшему её
+# воркеру, пауза перед повтором после ошибки (удваивается с каждой
+# попыткой) и число попыток, после которого задача ждёт
+# regenerate_thumbnails
+THUMBNAIL_JOB_LEASE = 60 * 5
+THUMBNAIL_JOB_RETRY = 60
+THUMBNAIL_JOB_MAX_ATTEMPTS = 5
+
+# Feeds
+# Сколько записей хранится в материализованной ленте подписок пользователя
+TIMELINE_MAX_ENTRIES = 1000
+# С какого числа подписчиков посты автора не раскладываются по лентам,
+# а читаются при открытии ленты
+FEED_CELEBRITY_FOLLOWERS = 10000
+# Знаменитость снова раскладывает посты, когда подписчиков становится
+# меньше этой доли порога и её посты за это время дописаны в ленты
+FEED_CELEBRITY_LEAVE = 0.9
+# Посты дописывает в ленты процесс manage.py feed_worker; столько секунд
+# автор принадлежит взявшему его воркеру
+FEED_BACKFILL_LEASE = 60 * 10
+FEED_CELEBRITIES_TIMEOUT = 60
+
+# Paginator
+# Число записей ленты кэшируется и сбрасывается при создании и удалении
+# постов; за порогом PAGINATOR_EXACT_COUNT_LIMIT число оценивается
+PAGINATOR_COUNT_TIMEOUT = 60 * 15
+PAGINATOR_COUNT_HARD_TIMEOUT = 60 * 60
+PAGINATOR_EXACT_COUNT_LIMIT = 10000
+# Сколько номеров страниц показывать по обе стороны от текущей
+PAGINATOR_WINDOW = 3
+# Записи страниц лент кэшируются под версией ленты, которую сигналы
+# увеличивают при изменении постов, комментариев и лайков. После мягкого
+# срока страницу пересобирает один воркер, остальные пока получают старую;
+# после жёсткого срока запись удаляется из кэша
+FEED_PAGE_SOFT_TIMEOUT = 60
+FEED_PAGE_CACHE_TIMEOUT = 60 * 15
+# Блокировка пересборки и сколько ждать сборщика, если старой копии нет
+CACHE_REBUILD_LOCK_TIMEOUT = 10
+CACHE_REBUILD_WAIT = 2
+# Попадания и промахи кэшей копятся в процессе и записываются в кэш для
+# manage.py cache_stats не чаще раза в столько секунд
+CACHE_STATS_FLUSH_INTERVAL = 30
+# Отрисованная карточка поста; правка поста меняет ключ через updated_at
+POST_CARD_CACHE_TIMEOUT = 60 * 60
+# Авторы по username и группы по slug; сигналы сбрасывают их при
+# сохранении и удалении, отсутствующие имена кэшируются ненадолго
+IDENTITY_CACHE_TIMEOUT = 60 * 60
+IDENTITY_MISS_TIMEOUT = 30
+# Фильтр Блума по username, slug и id постов отсекает несуществующие
+# ключи без запроса к базе; один воркер пересобирает его раз в
+# NEGATIVE_FILTER_REBUILD секунд. Ключи, которые фильтр пропустил, а
+# базы в них нет, кэшируются на NEGATIVE_MISS_TIMEOUT
+NEGATIVE_FILTER_REBUILD = 60 * 10
+NEGATIVE_FILTER_ERROR_RATE = 0.01
+NEGATIVE_MISS_TIMEOUT = 30
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# Страницы ошибок рисуются до первого запроса: под потоком 404 и при
+# отказе базы обработчики только отдают готовые байты.
+from core.views import warm_error_pages  # noqa: E402
+
+warm_error_pages()